@@ -1,60 +1,121 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from docx import Document
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, g
 import os
-import tempfile
-import traceback
+import logging
+import contextvars
+import functools
 from dotenv import load_dotenv
 import re
 import sys
 import time
-import requests
 import json
-
-# For document loading
-from PyPDF2 import PdfReader
-import docx2txt
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.llm_client import create_backend, LLMError, COHERE_CHAT_URL, DEFAULT_MODEL
+from utils.rate_limit import TokenBucket, RateLimiter, RateLimitedBackend, RateLimitExceeded
+from utils.cache import ResponseCache, make_key
+from utils.semantic_cache import SemanticCache
+from utils.template_store import TemplateStore, COMMON_TEMPLATE_TYPES, normalize_document_type
+from utils.jobs import JobQueue
+from utils.extraction import iter_pdf_pages, UploadBuffer, ArchiveReader, is_archive
+from utils.chunking import iter_chunks, iter_anchored_chunks, iter_clauses, count_tokens
+from utils.versions import DocumentVersionStore
+from utils.sessions import SessionStore
+from utils.clause_index import ClauseIndex
+from utils.singleflight import SingleFlight
+from utils.metrics import metrics, span, timed_iter
+from utils.docx_export import build_docx
+from utils.logging_config import configure_logging, request_id_var
 
 # Load environment variables
 load_dotenv()
 
+configure_logging(os.getenv('LOG_LEVEL', 'INFO'), os.getenv('LOG_FORMAT', 'text'))
+logger = logging.getLogger('legal_guardian')
+
 app = Flask(__name__)
 
 # Cohere configuration
 cohere_api_key = os.getenv('COHERE_API_KEY')
 if not cohere_api_key:
-    print("Error: No COHERE_API_KEY found in environment variables.")
-    print("Please create a .env file with your Cohere API key.")
+    logger.error("No COHERE_API_KEY found in environment variables.")
+    logger.error("Please create a .env file with your Cohere API key.")
 
 # Constants for chunking
 MAX_INPUT_TOKENS = 3500  # Reserve space for prompt context
-MAX_CHUNK_LENGTH = 15000  # Conservative character estimate per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', 0))  # Context repeated between chunks
+
+# Tree reduce: partial analyses are merged REDUCE_FAN_IN at a time until the
+# combined notes fit into a single final analysis prompt
+REDUCE_FAN_IN = max(2, int(os.getenv('REDUCE_FAN_IN', 4)))
+MAX_REDUCE_INPUT_TOKENS = int(os.getenv('MAX_REDUCE_INPUT_TOKENS', 8000))
+
+# Concurrency limits for the chunk analysis (map) phase
+CHUNK_WORKERS_PER_REQUEST = int(os.getenv('CHUNK_WORKERS_PER_REQUEST', 4))
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv('MAX_CONCURRENT_LLM_CALLS', 16))
+
+# Process-wide cap on in-flight chunk analyses, shared by all requests
+chunk_analysis_slots = threading.BoundedSemaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# Shared LLM client: keep-alive connection pool sized to the worker count.
+# LLM_API_URL can point at bench/mock_llm_server.py for load testing.
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'cohere')
+LLM_API_URL = os.getenv('LLM_API_URL', COHERE_CHAT_URL)
+LLM_MODEL = os.getenv('LLM_MODEL', DEFAULT_MODEL)
+
+# Token bucket in front of every LLM call. Set LLM_RATE_LIMIT_DB to share the
+# quota between worker processes; requests are refused with 503 once
+# LLM_MAX_WAITING calls are queued ahead of them.
+LLM_RATE_LIMIT = float(os.getenv('LLM_RATE_LIMIT', 10))  # calls per second
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', 20))
+LLM_MAX_WAITING = int(os.getenv('LLM_MAX_WAITING', 64))
+
+rate_limiter = RateLimiter(
+    TokenBucket(LLM_RATE_LIMIT, LLM_RATE_BURST, db_path=os.getenv('LLM_RATE_LIMIT_DB')),
+    max_waiting=LLM_MAX_WAITING
+)
+
+# Identical chunk analyses and template generations in flight at the same time
+# (e.g. a team opening the same file) share one LLM call
+llm_flights = SingleFlight(
+    db_path=os.getenv('LLM_SINGLEFLIGHT_DB'),
+    lease=int(os.getenv('LLM_SINGLEFLIGHT_LEASE', 120))
+)
+
+llm_client = RateLimitedBackend(create_backend(
+    LLM_BACKEND,
+    url=LLM_API_URL,
+    model=LLM_MODEL,
+    pool_size=MAX_CONCURRENT_LLM_CALLS,
+    timeout=LLM_TIMEOUT,
+    max_retries=LLM_MAX_RETRIES
+), rate_limiter)
+LLM_TEMPERATURE = 0.1
+
+# Cache for chunk and final analyses (set RESPONSE_CACHE_DB to persist to SQLite)
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)),
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', 7 * 24 * 3600)),
+    db_path=os.getenv('RESPONSE_CACHE_DB') or None
+)
 
 # Función para dividir texto en chunks
-def split_text(text, max_length=MAX_CHUNK_LENGTH):
-    """Split text into chunks of approximately max_length characters"""
+def iter_split_text(pieces, max_tokens=MAX_INPUT_TOKENS):
+    """Yield chunks of at most max_tokens tokens from an iterable of text pieces
+    (e.g. PDF pages), cut at article/section boundaries where possible"""
+    return iter_chunks(pieces, max_tokens, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+
+def split_text(text, max_tokens=MAX_INPUT_TOKENS):
+    """Split text into chunks of at most max_tokens tokens"""
     # If text is short enough, return it as a single chunk
-    if len(text) <= max_length:
+    if count_tokens(text) <= max_tokens:
         return [text]
 
-    chunks = []
-    # Split text by paragraphs
-    paragraphs = text.split('\n')
-    current_chunk = ""
-
-    for paragraph in paragraphs:
-        # If adding this paragraph would exceed the max length,
-        # save the current chunk and start a new one
-        if len(current_chunk) + len(paragraph) + 1 > max_length and current_chunk:
-            chunks.append(current_chunk)
-            current_chunk = paragraph + '\n'
-        else:
-            current_chunk += paragraph + '\n'
-
-    # Add the last chunk if it has content
-    if current_chunk:
-        chunks.append(current_chunk)
-
-    return chunks
+    return list(iter_split_text([text], max_tokens))
 
 # Templates
 # Template for legal consultation
@@ -68,7 +129,7 @@ Format your response using proper Markdown:
 - Use **bold** or *italic* for emphasis
 - Organize complex information into well-structured sections
 
-User's legal query: {query}
+{context}User's legal query: {query}
 
 Response (in markdown format):
 """
@@ -76,7 +137,7 @@ Response (in markdown format):
 # Template for document chunk analysis
 document_chunk_analysis_template = """
 You are a legal document analyst. Review the following document chunk and extract key legal information.
-This is chunk {chunk_num} of {total_chunks} from the document.
+This is {chunk_position} from the document.
 
 Use proper Markdown formatting in your response:
 - Use headers (## and ###) for sections
@@ -122,6 +183,23 @@ Key information extracted from the document:
 Provide your complete analysis following the structure above, using clear markdown formatting:
 """
 
+# Template for merging partial analyses (tree reduce for long documents)
+document_merge_analysis_template = """
+You are a legal document analyst. The following notes were extracted from consecutive parts ({part_range}) of a single long document.
+Merge them into one consolidated set of notes that the final analysis can be based on.
+
+Use proper Markdown formatting in your response:
+- Keep every party, date, amount, obligation, right, deadline and defined term that appears in the notes
+- Combine duplicated points instead of repeating them
+- Keep potential risks or unusual provisions, marking them in **bold**
+- Do not add analysis or recommendations that are not supported by the notes
+
+Notes to merge:
+{partial_analyses}
+
+Consolidated notes (using markdown formatting):
+"""
+
 # Template for legal document templates
 legal_template_generator = """
 You are a legal document specialist. Create a professional {document_type} template following standard legal practices.
@@ -141,260 +219,1043 @@ Follow these critical rules:
 Create a complete, ready-to-use {document_type} template:
 """
 
+# Template for answering a question from the retrieved clauses of an analyzed document
+document_question_template = """
+You are a legal assistant answering a question about a document the user shared earlier.
+Only the excerpts most relevant to the question are given below, not the whole document.
+
+Follow these rules:
+- Answer only from the excerpts, and cite the clause(s) you rely on
+- If the excerpts do not contain the answer, say so and suggest which part of the document to check
+- Be concise and use plain language; format your answer in Markdown
+
+Excerpts:
+{clauses}
+
+Question: {question}
+
+Answer (in markdown format):
+"""
+
+# Template for folding old conversation turns into a session summary
+conversation_summary_template = """
+You are maintaining the memory of a conversation between a user and a legal assistant.
+Update the summary below with the new messages. Keep every fact the user has stated about
+their situation (parties, dates, amounts, jurisdiction, documents) and the key advice given.
+Write at most 200 words of plain prose.
+
+Current summary: {summary}
+
+New messages:
+{turns}
+
+Updated summary:
+"""
+
+# Answers to consultations, looked up by question similarity. The namespace
+# fingerprints the prompt, so editing the template retires the old answers.
+consultation_cache = SemanticCache(
+    threshold=float(os.getenv('CONSULT_CACHE_THRESHOLD', 0.9)),
+    max_entries=int(os.getenv('CONSULT_CACHE_SIZE', 2048)),
+    ttl=int(os.getenv('CONSULT_CACHE_TTL', 24 * 3600))
+)
+CONSULT_CACHE_NAMESPACE = make_key('', legal_consultation_template, llm_client.model, LLM_TEMPERATURE)
+
+# Conversation sessions: recent turns are sent with each question, older ones
+# are folded into a running summary once they exceed SESSION_HISTORY_TOKENS
+SESSION_HISTORY_TOKENS = int(os.getenv('SESSION_HISTORY_TOKENS', 2000))
+SESSION_MAX_DOCUMENTS = int(os.getenv('SESSION_MAX_DOCUMENTS', 3))
+
+sessions = SessionStore(
+    max_sessions=int(os.getenv('SESSION_MAX', 1000)),
+    ttl=int(os.getenv('SESSION_TTL', 24 * 3600)),
+    db_path=os.getenv('SESSION_DB')
+)
+
+def _format_turns(turns):
+    return "\n\n".join(
+        f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['content']}" for turn in turns
+    )
+
+def session_context(session):
+    """Summary, shared document analyses and recent turns of a session, to put before the query"""
+    if session is None:
+        return ''
+    parts = []
+    if session['summary']:
+        parts.append(f"Summary of the earlier conversation:\n{session['summary']}")
+    for document in session['documents']:
+        # The cached analysis stands in for the document text
+        parts.append(f"Analysis of the document \"{document['name']}\" shared by the user:\n{document['analysis']}")
+    if session['turns']:
+        parts.append(f"Recent conversation:\n{_format_turns(session['turns'])}")
+    if not parts:
+        return ''
+    return "\n\n".join(parts) + "\n\n"
+
+def record_exchange(session, query, answer):
+    """Add a question and its answer, folding the oldest turns into the summary when over budget"""
+    exchange = [{'role': 'user', 'content': query}, {'role': 'assistant', 'content': answer}]
+    sessions.update(session, lambda record: record['turns'].extend(exchange))
+
+    turns = list(session['turns'])
+    folded = []
+    # The latest exchange is always kept verbatim
+    while len(turns) > 2 and count_tokens(_format_turns(turns)) > SESSION_HISTORY_TOKENS:
+        folded.extend(turns[:2])
+        del turns[:2]
+    if not folded:
+        return
+
+    prompt = conversation_summary_template.format(
+        summary=session['summary'] or 'None yet.',
+        turns=_format_turns(folded)
+    )
+    summary = None
+    try:
+        with span('session_summary'):
+            summary = llm_client.chat(prompt, max_tokens=400, temperature=LLM_TEMPERATURE)
+    except Exception as e:
+        # The folded turns are dropped anyway so the prompt stays bounded
+        logger.warning(f"Error summarizing session {session['id']}: {str(e)}")
+
+    def fold(record):
+        # Another worker may have folded these turns in the meantime
+        if record['turns'][:len(folded)] == folded:
+            del record['turns'][:len(folded)]
+            if summary is not None:
+                record['summary'] = summary
+    sessions.update(session, fold)
+
+def attach_document(session, name, analysis, index_id=None):
+    """Remember a document's analysis (and where its clauses are indexed) so follow-up questions can use it"""
+    def attach(record):
+        documents = [document for document in record['documents'] if document['name'] != name]
+        documents.append({'name': name, 'analysis': analysis, 'indexId': index_id})
+        record['documents'] = documents[-SESSION_MAX_DOCUMENTS:]
+    sessions.update(session, attach)
+
 # Funciones auxiliares para generar respuestas usando Cohere API directamente
-def get_consultation_response(query):
+def get_consultation_response(query, session=None):
+    context = session_context(session)
+    # Answers that depend on the conversation are not shared through the cache
+    if not context:
+        cached = consultation_cache.get(query, CONSULT_CACHE_NAMESPACE)
+        if cached is not None:
+            if session is not None:
+                record_exchange(session, query, cached)
+            return cached
+
     try:
-        api_key = os.getenv('COHERE_API_KEY')
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        prompt = legal_consultation_template.format(query=query)
-        
-        payload = {
-            "model": "command-r",
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 1024,
-            "temperature": 0.1
-        }
-        
-        response = requests.post(
-            'https://api.cohere.ai/v2/chat',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['message']['content'][0]['text']
-        else:
-            print(f"Error {response.status_code}: {response.text}")
-            return "Lo siento, ocurrió un error al procesar tu consulta."
-            
+        prompt = legal_consultation_template.format(query=query, context=context)
+        with span('consultation'):
+            response = llm_client.chat(prompt, temperature=LLM_TEMPERATURE)
+        if not context:
+            consultation_cache.set(query, response, CONSULT_CACHE_NAMESPACE)
+        if session is not None:
+            record_exchange(session, query, response)
+        return response
+    except LLMError as e:
+        logger.error(str(e))
+        return "Lo siento, ocurrió un error al procesar tu consulta."
     except Exception as e:
-        print(f"Error en consulta: {str(e)}")
+        logger.exception(f"Error en consulta: {str(e)}")
         return "Lo siento, ocurrió un error al procesar tu consulta."
 
-def get_chunk_analysis(document_chunk, chunk_num, total_chunks):
+NO_DOCUMENT_ANSWER = ("I couldn't find an analyzed document to answer from. Please analyze the document first "
+                      "(upload it or paste its text under Document Analysis), then ask your question.")
+
+def document_question_prompt(question, document_id=None, session=None):
+    """Prompt with the clauses most relevant to question, or None if none are indexed.
+
+    Only documents shared in the session are searched: the one named by
+    document_id (its documentId or file name), or else all of them.
+    """
+    if session is None:
+        return None
+    names = {document['indexId']: document['name'] for document in session['documents'] if document.get('indexId')}
+    if document_id:
+        requested = document_key(session, document_id)
+        names = {index_id: name for index_id, name in names.items() if index_id == requested or name == document_id}
+    index_ids = list(names)
+    if not index_ids:
+        return None
+
+    wait_for_index(index_ids)
+    with span('clause_search'):
+        clauses = clause_index.search(index_ids, question, CLAUSE_TOP_K)
+    if not clauses:
+        return None
+    # In document order, which reads better than relevance order
+    clauses.sort(key=lambda clause: (clause['document_id'], clause['position']))
+    excerpts = "\n\n".join(
+        f"[{names[clause['document_id']]}, excerpt {clause['position'] + 1}]\n{clause['text']}"
+        for clause in clauses
+    )
+    return document_question_template.format(clauses=excerpts, question=question)
+
+def get_document_answer(question, document_id=None, session=None):
+    """Answer a question about an analyzed document from its top-k clauses"""
     try:
-        api_key = os.getenv('COHERE_API_KEY')
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        prompt = document_chunk_analysis_template.format(
-            document_chunk=document_chunk,
-            chunk_num=chunk_num,
-            total_chunks=total_chunks
-        )
-        
-        payload = {
-            "model": "command-r",
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 1024,
-            "temperature": 0.1
-        }
-        
-        response = requests.post(
-            'https://api.cohere.ai/v2/chat',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['message']['content'][0]['text']
-        else:
-            return f"Error procesando chunk {chunk_num}"
-            
+        prompt = document_question_prompt(question, document_id, session)
+        if prompt is None:
+            return NO_DOCUMENT_ANSWER
+        cache_key = make_key(prompt, document_question_template, llm_client.model, LLM_TEMPERATURE)
+        answer = response_cache.get(cache_key)
+        if answer is None:
+            with span('document_question'):
+                answer = llm_client.chat(prompt, temperature=LLM_TEMPERATURE)
+            response_cache.set(cache_key, answer)
+        if session is not None:
+            record_exchange(session, question, answer)
+        return answer
+    except LLMError as e:
+        logger.error(str(e))
+        return "Lo siento, ocurrió un error al procesar tu pregunta."
     except Exception as e:
-        print(f"Error en análisis de chunk: {str(e)}")
+        logger.exception(f"Error en pregunta sobre documento: {str(e)}")
+        return "Lo siento, ocurrió un error al procesar tu pregunta."
+
+def _chunk_analysis_key(document_chunk):
+    # Chunk position is left out of the key so unchanged clauses hit even when
+    # a revision shifts them to a different chunk
+    return make_key(document_chunk, document_chunk_analysis_template,
+                    llm_client.model, LLM_TEMPERATURE)
+
+def _chunk_analysis_prompt(document_chunk, chunk_num, total_chunks=None):
+    # The total is unknown while chunks are still being extracted
+    if total_chunks:
+        chunk_position = f"chunk {chunk_num} of {total_chunks}"
+    else:
+        chunk_position = f"chunk {chunk_num}"
+    return document_chunk_analysis_template.format(
+        document_chunk=document_chunk,
+        chunk_position=chunk_position
+    )
+
+def get_chunk_analysis(document_chunk, chunk_num, total_chunks=None):
+    cache_key = _chunk_analysis_key(document_chunk)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        prompt = _chunk_analysis_prompt(document_chunk, chunk_num, total_chunks)
+
+        def analyze():
+            with span('chunk_analysis'):
+                analysis = llm_client.chat(prompt, temperature=LLM_TEMPERATURE, priority='bulk')
+            response_cache.set(cache_key, analysis)
+            return analysis
+
+        # Keyed like the cache, so the same chunk at another position shares the call too
+        return llm_flights.do(cache_key, analyze)
+    except LLMError:
         return f"Error procesando chunk {chunk_num}"
+    except Exception as e:
+        logger.exception(f"Error en análisis de chunk: {str(e)}")
+        return f"Error procesando chunk {chunk_num}"
+
+def _final_analysis_key(document_key_info):
+    return make_key(document_key_info, document_final_analysis_template,
+                    llm_client.model, LLM_TEMPERATURE)
 
 def get_final_analysis(document_key_info):
+    cache_key = _final_analysis_key(document_key_info)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        api_key = os.getenv('COHERE_API_KEY')
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
         prompt = document_final_analysis_template.format(document_key_info=document_key_info)
-        
-        payload = {
-            "model": "command-r",
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 1024,
-            "temperature": 0.1
-        }
-        
-        response = requests.post(
-            'https://api.cohere.ai/v2/chat',
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['message']['content'][0]['text']
-        else:
-            return "Error en análisis final"
-            
+        with span('final_analysis'):
+            analysis = llm_client.chat(prompt, temperature=LLM_TEMPERATURE)
+        response_cache.set(cache_key, analysis)
+        return analysis
+    except LLMError:
+        return "Error en análisis final"
     except Exception as e:
-        print(f"Error en análisis final: {str(e)}")
+        logger.exception(f"Error en análisis final: {str(e)}")
         return "Error en análisis final"
 
-def get_template(document_type):
+def _merge_analysis_key(joined_analyses):
+    return make_key(joined_analyses, document_merge_analysis_template,
+                    llm_client.model, LLM_TEMPERATURE)
+
+def get_merged_analysis(partial_analyses, part_range):
+    """Merge a group of partial analyses into one set of notes"""
+    joined = "\n\n".join(partial_analyses)
+    cache_key = _merge_analysis_key(joined)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        api_key = os.getenv('COHERE_API_KEY')
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        prompt = legal_template_generator.format(document_type=document_type)
-        
-        payload = {
-            "model": "command-r",
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": 1024,
-            "temperature": 0.1
-        }
-        
-        response = requests.post(
-            'https://api.cohere.ai/v2/chat',
-            headers=headers,
-            json=payload,
-            timeout=30
+        prompt = document_merge_analysis_template.format(
+            partial_analyses=joined,
+            part_range=part_range
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['message']['content'][0]['text']
-        else:
-            return "Error generando template"
-            
+        with span('merge_analysis'):
+            merged = llm_client.chat(prompt, temperature=LLM_TEMPERATURE, priority='bulk')
+        response_cache.set(cache_key, merged)
+        return merged
+    except Exception as e:
+        # Fall back to the unmerged notes; reduce_analyses stops if nothing shrinks
+        logger.warning(f"Error merging analyses {part_range}: {str(e)}")
+        return joined
+
+def _generate_template(document_type):
+    prompt = legal_template_generator.format(document_type=document_type)
+    flight_key = make_key(prompt, legal_template_generator, llm_client.model, LLM_TEMPERATURE)
+    return llm_flights.do(flight_key, lambda: llm_client.chat(prompt, temperature=LLM_TEMPERATURE))
+
+# Generated templates, keyed by normalized document type and shared with the
+# other workers (and the prewarm-templates command) through TEMPLATE_STORE_DB
+template_store = TemplateStore(
+    _generate_template,
+    ttl=int(os.getenv('TEMPLATE_CACHE_TTL', 24 * 3600)),
+    max_entries=int(os.getenv('TEMPLATE_CACHE_SIZE', 256)),
+    db_path=os.getenv('TEMPLATE_STORE_DB', 'templates.sqlite3') or None
+)
+# Generate the common templates when a serving process starts (start_background_work)
+TEMPLATE_PREWARM = os.getenv('TEMPLATE_PREWARM', '').lower() in ('1', 'true', 'yes')
+
+def get_template(document_type):
+    try:
+        with span('get_template'):
+            return template_store.get(document_type)
+    except LLMError:
+        return "Error generando template"
     except Exception as e:
-        print(f"Error generando template: {str(e)}")
+        logger.exception(f"Error generando template: {str(e)}")
         return "Error generando template"
 
+def _acquire_slot():
+    # Callers parked on the semaphore count as waiting in rate_limiter.admit()
+    with rate_limiter.queued('bulk'):
+        chunk_analysis_slots.acquire()
+
+def _analyze_chunk(chunk, chunk_num, total_chunks):
+    with span('llm_queue_wait'):
+        _acquire_slot()
+    try:
+        logger.debug(f"Processing chunk {chunk_num}/{total_chunks or '?'}")
+        return get_chunk_analysis(chunk, chunk_num, total_chunks)
+    finally:
+        chunk_analysis_slots.release()
+
+def iter_chunk_analyses(chunks, max_workers=CHUNK_WORKERS_PER_REQUEST):
+    """Analyze chunks concurrently, yielding (index, analysis, total) as each one finishes.
+
+    chunks may be a list or a lazy iterator (e.g. fed by page extraction); every
+    chunk is submitted as soon as it is produced, so LLM calls overlap extraction.
+    """
+    total_chunks = len(chunks) if isinstance(chunks, (list, tuple)) else None
+    if max_workers <= 1 or total_chunks == 1:
+        chunks = list(chunks)
+        for i, chunk in enumerate(chunks):
+            yield i, _analyze_chunk(chunk, i+1, len(chunks)), len(chunks)
+        return
+
+    workers = min(max_workers, total_chunks or max_workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chunk-analysis') as executor:
+        futures = {}
+        for i, chunk in enumerate(chunks):
+            # copy_context() carries the request ID into the worker thread's logs
+            future = executor.submit(contextvars.copy_context().run, _analyze_chunk, chunk, i+1, total_chunks)
+            futures[future] = i
+        submitted = len(futures)
+        for future in as_completed(futures):
+            yield futures[future], future.result(), submitted
+
+def _merge_group(group, part_range):
+    if len(group) == 1:
+        return group[0]
+    _acquire_slot()
+    try:
+        return get_merged_analysis(group, part_range)
+    finally:
+        chunk_analysis_slots.release()
+
+def reduce_analyses(analyses, fan_in=REDUCE_FAN_IN, max_tokens=MAX_REDUCE_INPUT_TOKENS):
+    """Merge partial analyses level by level until they fit one final prompt.
+
+    Groups of fan_in consecutive analyses are merged in parallel at each level,
+    so the number of levels grows logarithmically with the chunk count.
+    """
+    level = 0
+    # Part numbers covered by each analysis, for the merge prompt
+    spans = [(i + 1, i + 1) for i in range(len(analyses))]
+    combined_tokens = count_tokens("\n\n".join(analyses))
+
+    while len(analyses) > 1 and combined_tokens > max_tokens:
+        level += 1
+        groups = [analyses[i:i + fan_in] for i in range(0, len(analyses), fan_in)]
+        group_spans = [(spans[i][0], spans[min(i + fan_in, len(spans)) - 1][1])
+                       for i in range(0, len(spans), fan_in)]
+        part_ranges = [f"parts {start}-{end}" for start, end in group_spans]
+        logger.info(f"Reduce level {level}: merging {len(analyses)} analyses into {len(groups)}")
+
+        workers = max(1, min(CHUNK_WORKERS_PER_REQUEST, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reduce') as executor:
+            futures = [executor.submit(contextvars.copy_context().run, _merge_group, group, part_range)
+                       for group, part_range in zip(groups, part_ranges)]
+            merged = [future.result() for future in futures]
+
+        merged_tokens = count_tokens("\n\n".join(merged))
+        if merged_tokens >= combined_tokens:
+            # Merging did not shrink anything (e.g. the merge calls failed)
+            break
+        analyses, spans, combined_tokens = merged, group_spans, merged_tokens
+
+    return "\n\n".join(analyses)
+
+# Latest chunks and analyses per document ID, for incremental re-analysis of revisions
+document_versions = DocumentVersionStore(
+    max_documents=int(os.getenv('DOCUMENT_VERSIONS_MAX', 256)),
+    db_path=os.getenv('DOCUMENT_VERSIONS_DB')
+)
+
+def document_key(session, document_id):
+    """Store key of a client-chosen documentId.
+
+    documentIds only mean something within the session that sent them, so two
+    users who both pick "contract" never share versions.
+    """
+    return f"{session['id']}:{document_id}"
+
+def version_chunks(content, document_id):
+    """Chunks of a tracked document, aligned with its previous version.
+
+    Unchanged stretches come back as the previous version's chunks and their
+    stored analyses are put back into the response cache, so the map phase
+    only calls the LLM for the chunks that changed.
+    """
+    pieces = [content] if isinstance(content, str) else content
+    previous = document_versions.get(document_id)
+    with span('split_text'):
+        if previous is None:
+            return list(iter_split_text(pieces))
+        previous_chunks = [chunk['text'] for chunk in previous['chunks']]
+        chunks = list(iter_anchored_chunks(pieces, previous_chunks, MAX_INPUT_TOKENS, CHUNK_OVERLAP_TOKENS))
+
+    known = {chunk['key']: chunk['analysis'] for chunk in previous['chunks'] if chunk['analysis'] is not None}
+    changed = 0
+    for chunk in chunks:
+        key = _chunk_analysis_key(chunk)
+        if key in known:
+            response_cache.set(key, known[key])
+        else:
+            changed += 1
+    logger.info(f"Document {document_id} v{previous['version'] + 1}: {changed} of {len(chunks)} chunks changed")
+    return chunks
+
+def record_document_version(document_id, chunks, analyses):
+    """Store the chunks and analyses of a tracked document. Returns the new version number."""
+    records = []
+    for i, (chunk, analysis) in enumerate(zip(chunks, analyses)):
+        # Failed chunks are not kept, so the next version retries them
+        if analysis == f"Error procesando chunk {i + 1}":
+            analysis = None
+        records.append({'text': chunk, 'key': _chunk_analysis_key(chunk), 'analysis': analysis})
+    return document_versions.put(document_id, records)
+
+# Clauses of analyzed documents, so targeted questions about them take one
+# small LLM call over the top-k clauses instead of a full re-analysis
+CLAUSE_TOP_K = int(os.getenv('CLAUSE_TOP_K', 6))
+CLAUSE_MAX_TOKENS = int(os.getenv('CLAUSE_MAX_TOKENS', 300))
+
+clause_index = ClauseIndex(
+    db_path=os.getenv('CLAUSE_INDEX_DB'),
+    embeddings=os.getenv('CLAUSE_INDEX_EMBEDDINGS', 'true').lower() in ('1', 'true', 'yes'),
+    max_documents=int(os.getenv('CLAUSE_INDEX_MAX_DOCUMENTS', 1000))
+)
+
+# Indexing embeds every clause, so it runs off the analysis pipeline
+CLAUSE_INDEX_WORKERS = int(os.getenv('CLAUSE_INDEX_WORKERS', 1))
+CLAUSE_INDEX_WAIT = float(os.getenv('CLAUSE_INDEX_WAIT', 30))  # seconds a question waits for pending indexing
+
+clause_index_pool = ThreadPoolExecutor(max_workers=CLAUSE_INDEX_WORKERS, thread_name_prefix='clause-index')
+pending_index = {}  # index_id -> Future
+pending_index_lock = threading.Lock()
+
+def document_index_id(document_id, session=None, name=None):
+    """Clause index key of a document within its session (see document_key)"""
+    if session is None:
+        return None
+    return document_key(session, document_id or name or 'Pasted document')
+
+def _index_clauses(index_id, chunks):
+    try:
+        with span('clause_index'):
+            clauses = list(iter_clauses(chunks, CLAUSE_MAX_TOKENS))
+            clause_index.put(index_id, clauses)
+        logger.info(f"Indexed {len(clauses)} clauses of {index_id}")
+    except Exception as e:
+        # Indexing only serves later questions; the analysis itself goes on
+        logger.warning(f"Error indexing clauses of {index_id}: {str(e)}")
+
+def index_document(index_id, chunks):
+    """Split the analysis chunks of a document into clauses and index them in the background"""
+    future = clause_index_pool.submit(contextvars.copy_context().run, _index_clauses, index_id, list(chunks))
+    with pending_index_lock:
+        pending_index[index_id] = future
+
+    def forget(done):
+        with pending_index_lock:
+            if pending_index.get(index_id) is done:
+                del pending_index[index_id]
+    future.add_done_callback(forget)
+
+def wait_for_index(index_ids, timeout=CLAUSE_INDEX_WAIT):
+    """Wait for the pending indexing of index_ids, so a question asked right after an analysis sees its clauses"""
+    with pending_index_lock:
+        futures = [pending_index[index_id] for index_id in index_ids if index_id in pending_index]
+    deadline = time.time() + timeout
+    for future in futures:
+        try:
+            future.result(timeout=max(0, deadline - time.time()))
+        except Exception:
+            # Timed out: search whatever is indexed already
+            break
+
+def _collect(chunks, collected):
+    for chunk in chunks:
+        collected.append(chunk)
+        yield chunk
+
+def analyze_document(content, report=None, document_id=None, index_id=None):
+    """Split content, analyze the chunks concurrently and build the final analysis.
+
+    content is either the full text or an iterable of text pieces (pages).
+    report(stage, done, total) is called as chunks finish, if given. With a
+    document_id (a document_key), only the chunks changed since that
+    document's previous version are re-analyzed. The clauses are indexed in
+    the background under index_id (by default the document_id) for later questions.
+    """
+    index_id = index_id or document_id
+    logger.info("Splitting document into chunks")
+    if document_id:
+        chunks = version_chunks(content, document_id)
+    elif isinstance(content, str):
+        with span('split_text'):
+            chunks = split_text(content)
+    else:
+        chunks = timed_iter(iter_split_text(content), 'split_text')
+
+    indexed_chunks = chunks if isinstance(chunks, list) else []
+    if index_id and not isinstance(chunks, list):
+        chunks = _collect(chunks, indexed_chunks)
+
+    logger.info("Processing chunks")
+    chunk_analyses = {}
+    total_chunks = 0
+    for index, analysis, total_chunks in iter_chunk_analyses(chunks):
+        chunk_analyses[index] = analysis
+        if report:
+            report('chunks', len(chunk_analyses), total_chunks)
+    logger.info(f"Document split into {total_chunks} chunks")
+
+    ordered_analyses = [chunk_analyses[i] for i in range(total_chunks)]
+    if document_id:
+        record_document_version(document_id, chunks, ordered_analyses)
+    if index_id:
+        index_document(index_id, indexed_chunks)
+
+    logger.info("Combining chunk analyses for final analysis")
+    if report:
+        report('reduce', total_chunks, total_chunks)
+    with span('reduce'):
+        combined_analysis = reduce_analyses(ordered_analyses)
+    if report:
+        report('final', total_chunks, total_chunks)
+    return get_final_analysis(combined_analysis)
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.txt')
+
+def is_supported_file(filename):
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def iter_document_text(source, filename):
+    """Yield the text of a PDF, DOCX or TXT upload piece by piece (pages for PDFs).
+
+    source is a file path or a binary file object.
+    """
+    extension = os.path.splitext(filename)[1].lower().lstrip('.') or 'unknown'
+    return timed_iter(_iter_document_text(source, filename), 'extraction', format=extension)
+
+def _iter_document_text(source, filename):
+    filename = filename.lower()
+
+    if filename.endswith('.pdf'):
+        logger.info("Processing PDF file")
+        page_count = 0
+        for page_text in iter_pdf_pages(source):
+            page_count += 1
+            yield page_text
+        logger.info(f"Extracted {page_count} pages from PDF")
+
+    elif filename.endswith('.docx'):
+        logger.info("Processing DOCX file")
+        # Usamos docx2txt en vez de LangChain loader (importado solo al primer DOCX)
+        import docx2txt
+        yield docx2txt.process(source)
+        logger.info("DOCX content extracted")
+
+    elif filename.endswith('.txt'):
+        logger.info("Processing TXT file")
+        if isinstance(source, str):
+            with open(source, 'r', encoding='utf-8', errors='replace') as f:
+                yield f.read()
+        else:
+            yield source.read().decode('utf-8', errors='replace')
+        logger.info("TXT content extracted")
+
+    else:
+        raise ValueError(f"Unsupported file format: {filename}")
+
+# Background document analysis jobs
+JOB_UPLOAD_DIR = os.getenv('JOB_UPLOAD_DIR', os.path.join('uploads', 'jobs'))
+
+def run_document_job(payload, report):
+    path = payload['path']
+    try:
+        report('extracting')
+        analysis = analyze_document(iter_document_text(path, payload['filename']), report,
+                                    document_id=payload.get('document_id'), index_id=payload.get('index_id'))
+        # Follow-up questions in the uploader's session can use the document
+        session = sessions.get(payload.get('session_id'))
+        if session is not None:
+            attach_document(session, payload['filename'], analysis, payload.get('index_id'))
+        return analysis
+    finally:
+        # Kept until the job is done or failed: a job resumed after a restart reads it again
+        if os.path.exists(path):
+            os.remove(path)
+
+job_queue = JobQueue(
+    run_document_job,
+    db_path=os.getenv('JOB_STORE_DB', 'jobs.sqlite3'),
+    max_workers=int(os.getenv('JOB_WORKERS', 2)),
+    lease=int(os.getenv('JOB_LEASE', 60))
+)
+
+_started = False
+_started_lock = threading.Lock()
+
+def start_background_work():
+    """Resume abandoned jobs and start template pre-warming, once per serving process.
+
+    Not run at import: CLI commands, tools that import app and the PDF
+    extraction workers (which re-import the main module) start no threads and
+    make no LLM calls.
+    """
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    resumed_jobs = job_queue.resume()
+    if resumed_jobs:
+        logger.info(f"Resumed {resumed_jobs} unfinished document jobs")
+    if TEMPLATE_PREWARM:
+        threading.Thread(
+            target=template_store.prewarm,
+            args=(COMMON_TEMPLATE_TYPES,),
+            name='template-prewarm',
+            daemon=True
+        ).start()
+        template_store.start_background_refresh()
+
+# Batch analysis: the chunks of every document in a batch share one work queue,
+# so the LLM stays busy while other documents are still being extracted
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 500))
+BATCH_DOCUMENT_WORKERS = int(os.getenv('BATCH_DOCUMENT_WORKERS', 8))  # documents extracted/reduced at once
+
+def _analyze_batch_document(open_upload, chunk_pool):
+    """Extract one document, queue its chunks on the shared pool, then reduce it"""
+    with open_upload() as upload:
+        content = iter_document_text(upload.source, upload.filename)
+        futures = []
+        for chunk in timed_iter(iter_split_text(content), 'split_text'):
+            futures.append(chunk_pool.submit(contextvars.copy_context().run,
+                                             _analyze_chunk, chunk, len(futures) + 1, None))
+        analyses = [future.result() for future in futures]
+    if not analyses:
+        raise ValueError("No text could be extracted")
+
+    with span('reduce'):
+        combined_analysis = reduce_analyses(analyses)
+    return get_final_analysis(combined_analysis), len(analyses)
+
+def iter_batch_results(documents):
+    """Analyze (name, open_upload) pairs concurrently, yielding a result dict per document as it finishes"""
+    chunk_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_LLM_CALLS, thread_name_prefix='batch-chunk')
+    document_pool = ThreadPoolExecutor(max_workers=BATCH_DOCUMENT_WORKERS, thread_name_prefix='batch-document')
+    futures = {}
+    try:
+        for index, (name, open_upload) in enumerate(documents):
+            future = document_pool.submit(contextvars.copy_context().run,
+                                          _analyze_batch_document, open_upload, chunk_pool)
+            futures[future] = (index, name)
+
+        for future in as_completed(futures):
+            index, name = futures[future]
+            try:
+                analysis, chunk_count = future.result()
+                yield {'index': index, 'filename': name, 'status': 'done',
+                       'chunks': chunk_count, 'response': analysis}
+            except Exception as e:
+                logger.exception(f"Error analyzing batch document {name}: {str(e)}")
+                yield {'index': index, 'filename': name, 'status': 'failed',
+                       'response': 'Sorry, I encountered an issue processing your document. Please try again with a different document or format.'}
+    finally:
+        # Stop queued work if the client went away before the batch finished
+        document_pool.shutdown(wait=False, cancel_futures=True)
+        chunk_pool.shutdown(wait=False, cancel_futures=True)
+
+# Streaming (Server-Sent Events) helpers
+def wants_stream(flag=None):
+    """True if the client asked for a streamed response"""
+    if flag is not None and str(flag).lower() in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def stream_consultation_response(query, session=None):
+    context = session_context(session)
+    if not context:
+        cached = consultation_cache.get(query, CONSULT_CACHE_NAMESPACE)
+        if cached is not None:
+            yield cached
+            if session is not None:
+                record_exchange(session, query, cached)
+            return
+
+    try:
+        prompt = legal_consultation_template.format(query=query, context=context)
+        parts = []
+        for text in timed_iter(llm_client.chat_stream(prompt, temperature=LLM_TEMPERATURE), 'consultation'):
+            parts.append(text)
+            yield text
+        response = ''.join(parts)
+        if not context:
+            consultation_cache.set(query, response, CONSULT_CACHE_NAMESPACE)
+        if session is not None:
+            record_exchange(session, query, response)
+    except LLMError as e:
+        logger.error(str(e))
+        yield "Lo siento, ocurrió un error al procesar tu consulta."
+
+def stream_document_answer(question, document_id=None, session=None):
+    prompt = document_question_prompt(question, document_id, session)
+    if prompt is None:
+        yield NO_DOCUMENT_ANSWER
+        return
+    cache_key = make_key(prompt, document_question_template, llm_client.model, LLM_TEMPERATURE)
+    answer = response_cache.get(cache_key)
+    if answer is not None:
+        yield answer
+    else:
+        try:
+            parts = []
+            for text in timed_iter(llm_client.chat_stream(prompt, temperature=LLM_TEMPERATURE), 'document_question'):
+                parts.append(text)
+                yield text
+            answer = ''.join(parts)
+            response_cache.set(cache_key, answer)
+        except LLMError as e:
+            logger.error(str(e))
+            yield "Lo siento, ocurrió un error al procesar tu pregunta."
+            return
+    if session is not None:
+        record_exchange(session, question, answer)
+
+def stream_final_analysis(document_key_info):
+    cache_key = _final_analysis_key(document_key_info)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    try:
+        prompt = document_final_analysis_template.format(document_key_info=document_key_info)
+        parts = []
+        for text in timed_iter(llm_client.chat_stream(prompt, temperature=LLM_TEMPERATURE), 'final_analysis'):
+            parts.append(text)
+            yield text
+        response_cache.set(cache_key, ''.join(parts))
+    except LLMError as e:
+        logger.error(f"Error en análisis final: {str(e)}")
+        yield "Error en análisis final"
+
+def stream_template(document_type):
+    cached = template_store.lookup(document_type)
+    if cached is not None:
+        yield cached
+        return
+
+    try:
+        _, canonical = normalize_document_type(document_type)
+        prompt = legal_template_generator.format(document_type=canonical)
+        parts = []
+        for text in timed_iter(llm_client.chat_stream(prompt, temperature=LLM_TEMPERATURE), 'get_template'):
+            parts.append(text)
+            yield text
+        template_store.put(document_type, ''.join(parts))
+    except LLMError as e:
+        logger.error(f"Error generando template: {str(e)}")
+        yield "Error generando template"
+
+def stream_document_analysis(content, error_message, document_id=None, session=None, name=None):
+    """SSE events for the chunk -> final analysis pipeline"""
+    try:
+        done_data = {'sessionId': session['id']} if session is not None else {}
+        index_id = document_index_id(document_id, session, name)
+        # Versions are tracked per session, see document_key
+        version_key = document_key(session, document_id) if document_id and session is not None else None
+        if version_key:
+            chunks = version_chunks(content, version_key)
+        elif isinstance(content, str):
+            with span('split_text'):
+                chunks = split_text(content)
+        else:
+            chunks = timed_iter(iter_split_text(content), 'split_text')
+
+        indexed_chunks = chunks if isinstance(chunks, list) else []
+        if index_id and not isinstance(chunks, list):
+            chunks = _collect(chunks, indexed_chunks)
+
+        chunk_analyses = {}
+        total_chunks = 0
+        for index, analysis, total_chunks in iter_chunk_analyses(chunks):
+            chunk_analyses[index] = analysis
+            done = len(chunk_analyses)
+            yield sse_event('progress', {
+                'stage': 'chunk',
+                'done': done,
+                'total': total_chunks,
+                'message': f"chunk {done}/{total_chunks} done"
+            })
+
+        ordered_analyses = [chunk_analyses[i] for i in range(total_chunks)]
+        if version_key:
+            version = record_document_version(version_key, chunks, ordered_analyses)
+            done_data.update({'documentId': document_id, 'version': version})
+        if index_id:
+            index_document(index_id, indexed_chunks)
+
+        yield sse_event('progress', {'stage': 'reduce'})
+        combined_analysis = reduce_analyses(ordered_analyses)
+        yield sse_event('progress', {'stage': 'final'})
+        parts = []
+        for text in stream_final_analysis(combined_analysis):
+            parts.append(text)
+            yield sse_event('token', {'text': text})
+        if session is not None:
+            attach_document(session, name or document_id or 'Pasted document', ''.join(parts), index_id)
+        yield sse_event('done', done_data)
+    except Exception as e:
+        logger.exception(f"Error in streamed document analysis: {str(e)}")
+        yield sse_event('error', {'response': error_message})
+
+def stream_text(texts, done_data=None):
+    """Wrap a text generator into token events followed by a done event"""
+    try:
+        for text in texts:
+            yield sse_event('token', {'text': text})
+        yield sse_event('done', done_data or {})
+    except Exception as e:
+        logger.exception(f"Error in streamed response: {str(e)}")
+        yield sse_event('error', {'response': 'Sorry, an unexpected error occurred. Please try again.'})
+
+def document_response(analysis, document_id=None, session=None):
+    """JSON body for a document analysis, with the version number of tracked documents"""
+    response_data = {'response': analysis}
+    if session is not None:
+        response_data['sessionId'] = session['id']
+    if document_id and session is not None:
+        record = document_versions.get(document_key(session, document_id))
+        response_data['documentId'] = document_id
+        response_data['version'] = record['version'] if record else None
+    return response_data
+
+def rate_limited_response(error):
+    """503 telling the client when the LLM queue is expected to have room"""
+    response = jsonify({'response': 'The service is busy right now. Please try again in a moment.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+# Request correlation and latency metrics
+@app.before_request
+def start_request():
+    # Covers servers that import the app (gunicorn, flask run) rather than run __main__
+    start_background_work()
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    g.request_token = request_id_var.set(g.request_id)
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def finish_request(response):
+    response.headers['X-Request-ID'] = g.request_id
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('http_request_duration_seconds', elapsed,
+                    endpoint=endpoint, method=request.method, status=response.status_code)
+    logger.info(f"{request.method} {request.path} -> {response.status_code} in {elapsed * 1000:.1f} ms")
+    return response
+
+@app.teardown_request
+def reset_request_id(exc=None):
+    token = g.pop('request_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
 @app.route('/')
 def index():
-    print("Loading index page")
     return render_template('index.html')
 
 @app.route('/status', methods=['GET'])
 def status():
     """Simple endpoint to check API connectivity"""
     try:
-        api_key = os.getenv('COHERE_API_KEY')
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            "model": "command-r",
-            "messages": [{"role": "user", "content": "Hello"}],
-            "max_tokens": 5
-        }
-        
-        response = requests.post(
-            'https://api.cohere.ai/v2/chat',
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return f"API connection working! Response: {result['message']['content'][0]['text']}"
-        else:
-            return f"API error: {response.status_code} - {response.text}"
-            
+        text = llm_client.chat("Hello", max_tokens=5, temperature=None, timeout=10)
+        return f"API connection working! Response: {text}"
+    except LLMError as e:
+        if e.status_code is not None:
+            return f"API error: {e.status_code} - {e.body}"
+        return f"API connection error: {str(e)}"
     except Exception as e:
         return f"API connection error: {str(e)}"
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint: stage latency histograms and cache counters"""
+    for cache_name, stats in (('responses', response_cache.get_stats()),
+                              ('templates', template_store.get_stats()),
+                              ('consultations', consultation_cache.get_stats())):
+        for key, value in stats.items():
+            metrics.set_gauge('cache_' + key, value, cache=cache_name)
+    for key, value in clause_index.get_stats().items():
+        metrics.set_gauge('clause_index_' + key, value)
+    for key, value in llm_flights.get_stats().items():
+        metrics.set_gauge('llm_singleflight_' + key, value)
+    for key, value in rate_limiter.get_stats().items():
+        metrics.set_gauge('llm_rate_limit_' + key, value)
+    for key, value in sessions.get_stats().items():
+        metrics.set_gauge('sessions_' + key, value)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the analysis, template and consultation caches, and session counts"""
+    return jsonify({
+        'responses': response_cache.get_stats(),
+        'templates': template_store.get_stats(),
+        'consultations': consultation_cache.get_stats(),
+        'sessions': sessions.get_stats(),
+        'clauses': clause_index.get_stats(),
+        'singleflight': llm_flights.get_stats()
+    })
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
-        print("Received request to /api/chat")
         data = request.json
-        print(f"Request data: {data}")
         message = data.get('message')
         feature = data.get('feature', 'legal-consult')
+        stream = wants_stream(data.get('stream'))
 
-        print(f"Message: {message}")
-        print(f"Feature: {feature}")
+        logger.info(f"Chat request: feature={feature} message_chars={len(message or '')} stream={stream}")
 
         if not message:
-            print("Error: Missing message parameter")
+            logger.warning("Missing message parameter")
             return jsonify({'error': 'Missing message parameter'}), 400
 
+        # Chunk analyses of a pasted document queue behind interactive requests
+        rate_limiter.admit('bulk' if feature == 'document-analysis' else 'interactive')
+
         # Handle different features
+        # Consultations and analyses belong to a conversation; a new one is
+        # started when no (live) sessionId is given
+        session = None
+        if feature in ('legal-consult', 'document-analysis', 'document-question'):
+            session = sessions.get_or_create(data.get('sessionId'))
+
         if feature == 'legal-consult':
-            print("Processing legal consultation")
+            logger.info("Processing legal consultation")
+            if stream:
+                return sse_response(stream_text(stream_consultation_response(message, session),
+                                                {'sessionId': session['id']}))
             try:
-                response_content = get_consultation_response(message)
-                print(f"Consultation response generated: {str(response_content)[:100]}...")
+                response_content = get_consultation_response(message, session)
+                logger.debug(f"Consultation response generated: {str(response_content)[:100]}...")
             except Exception as chain_error:
-                print(f"Error in consultation chain: {str(chain_error)}")
-                print(traceback.format_exc())
+                logger.exception(f"Error in consultation chain: {str(chain_error)}")
                 # Generic message without technical details
                 return jsonify({'response': 'Sorry, I encountered an issue answering your legal question. Please try again or rephrase your question.'}), 200
-            return jsonify({'response': response_content})
+            return jsonify({'response': response_content, 'sessionId': session['id']})
 
         elif feature == 'document-analysis':
-            print("Processing document analysis")
+            logger.info("Processing document analysis")
+            # Revisions sent under the same documentId only re-analyze what changed
+            document_id = data.get('documentId') or None
+            if stream:
+                return sse_response(stream_document_analysis(
+                    message,
+                    'Sorry, I encountered an issue analyzing this document. Please try again with a different document or format.',
+                    document_id,
+                    session
+                ))
             try:
                 # Always use chunking for document analysis
-                print("Splitting document into chunks")
-                chunks = split_text(message)
-                print(f"Document split into {len(chunks)} chunks")
-
-                # Process multiple chunks
-                print("Processing chunks")
-                chunk_analyses = []
-                for i, chunk in enumerate(chunks):
-                    print(f"Processing chunk {i+1}/{len(chunks)}")
-                    chunk_content = get_chunk_analysis(
-                        chunk,
-                        i+1,
-                        len(chunks)
-                    )
-                    chunk_analyses.append(chunk_content)
-
-                # Combine analyses
-                print("Combining chunk analyses for final analysis")
-                combined_analysis = "\n\n".join(chunk_analyses)
-                response_content = get_final_analysis(combined_analysis)
-
-                print(f"Analysis response generated: {response_content[:100]}...")
+                index_id = document_index_id(document_id, session)
+                version_key = document_key(session, document_id) if document_id else None
+                response_content = analyze_document(message, document_id=version_key, index_id=index_id)
+                attach_document(session, document_id or 'Pasted document', response_content, index_id)
+
+                logger.debug(f"Analysis response generated: {response_content[:100]}...")
 
             except Exception as analysis_error:
-                print(f"Error in document analysis: {str(analysis_error)}")
-                print(traceback.format_exc())
+                logger.exception(f"Error in document analysis: {str(analysis_error)}")
                 return jsonify({'response': 'Sorry, I encountered an issue analyzing this document. Please try again with a different document or format.'}), 200
 
-            return jsonify({'response': response_content})
+            return jsonify(document_response(response_content, document_id, session))
 
-        elif feature == 'legal-templates':
-            print("Processing legal template generation")
+        elif feature == 'document-question':
+            logger.info("Processing question about an analyzed document")
+            # Without a documentId, the documents shared in the session are searched
+            document_id = data.get('documentId') or None
+            if stream:
+                return sse_response(stream_text(stream_document_answer(message, document_id, session),
+                                                {'sessionId': session['id']}))
             try:
-                print(f"Attempting to generate template for: '{message}'")
+                response_content = get_document_answer(message, document_id, session)
+            except Exception as question_error:
+                logger.exception(f"Error answering document question: {str(question_error)}")
+                return jsonify({'response': 'Sorry, I encountered an issue answering your question about this document. Please try again.'}), 200
+            return jsonify({'response': response_content, 'sessionId': session['id']})
 
+        elif feature == 'legal-templates':
+            logger.info("Processing legal template generation")
+            if stream:
+                return sse_response(stream_text(stream_template(message), {
+                    'response': f"I've created a {message} template for you. You can use this as a starting point and customize it to your specific needs.",
+                    'templateType': message
+                }))
+            try:
                 template_content = get_template(message)
-                print(f"Template generated for '{message}'")
+                logger.debug(f"Template generated for '{message}'")
 
                 response_data = {
                     'response': f"I've created a {message} template for you. You can use this as a starting point and customize it to your specific needs.",
@@ -405,148 +1266,246 @@ def chat():
                 return jsonify(response_data)
 
             except Exception as template_error:
-                print(f"ERROR IN TEMPLATE GENERATION: {str(template_error)}")
-                print(f"Error type: {type(template_error).__name__}")
-                print(f"Template type requested: '{message}'")
-                print(traceback.format_exc())
+                logger.exception(f"Error in template generation for '{message}': {str(template_error)}")
 
                 # Generic message without technical details
                 return jsonify({'response': 'Sorry, I encountered an issue creating this template. Please try a different template type or check your request.'}), 200
 
         else:
-            print(f"Invalid feature specified: {feature}")
+            logger.warning(f"Invalid feature specified: {feature}")
             return jsonify({'error': 'Invalid feature specified'}), 400
 
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
-        error_traceback = traceback.format_exc()
-        print(f"Unhandled error in /api/chat: {str(e)}")
-        print(error_traceback)
+        logger.exception(f"Unhandled error in /api/chat: {str(e)}")
         # Generic message without technical details
         return jsonify({'response': 'Sorry, an unexpected error occurred. Please try again.'}), 200
 
 @app.route('/api/document-upload', methods=['POST'])
 def document_upload():
-    print("Received request to /api/document-upload")
     if 'file' not in request.files:
-        print("Error: No file part in request")
+        logger.warning("No file part in request")
         return jsonify({'error': 'No file part'}), 400
 
     file = request.files['file']
-    print(f"File received: {file.filename}")
+    logger.info(f"File received: {file.filename}")
 
     if file.filename == '':
-        print("Error: No selected file")
+        logger.warning("No selected file")
         return jsonify({'error': 'No selected file'}), 400
 
-    try:
-        # Create uploads directory if it doesn't exist
-        os.makedirs('uploads', exist_ok=True)
-        file_path = os.path.join('uploads', file.filename)
-        file.save(file_path)
-        print(f"File saved to {file_path}")
+    if not is_supported_file(file.filename):
+        logger.warning(f"Unsupported file format: {file.filename.lower()}")
+        return jsonify({'response': 'Unsupported file format. Please upload PDF, DOCX, or TXT files.'}), 200
 
-        # Use specialized document loaders based on file type
-        content = ""
-        filename = file.filename.lower()
+    # Revisions uploaded under the same documentId only re-analyze what changed
+    document_id = request.form.get('documentId') or None
+
+    try:
+        session = sessions.get_or_create(request.form.get('sessionId'))
+        version_key = document_key(session, document_id) if document_id else None
+
+        if request.form.get('async', '').lower() in ('1', 'true', 'yes'):
+            # Hand the file to the job queue and return straight away
+            os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+            extension = os.path.splitext(file.filename)[1].lower()
+            job_path = os.path.join(JOB_UPLOAD_DIR, uuid.uuid4().hex + extension)
+            with span('upload_save'):
+                file.save(job_path)
+            job_id = job_queue.submit({
+                'path': job_path,
+                'filename': file.filename,
+                'document_id': version_key,
+                'index_id': document_index_id(document_id, session, file.filename),
+                'session_id': session['id']
+            })
+            logger.info(f"Queued document job {job_id} for {file.filename}")
+            return jsonify({
+                'jobId': job_id,
+                'status': 'queued',
+                'statusUrl': f"/api/jobs/{job_id}",
+                'sessionId': session['id']
+            }), 202
+
+        rate_limiter.admit('bulk')
+
+        # Keep the upload in memory; only large files are spilled to a unique
+        # temporary path, so concurrent uploads never share a file
+        with span('upload_save'):
+            upload = UploadBuffer(file.stream, file.filename)
+        logger.info(f"File buffered {'at ' + upload.path if upload.path else 'in memory'}")
+
+        # Use specialized document loaders based on file type. Pages are
+        # extracted lazily so the first chunk analyses start before the last
+        # page is read.
+        content = iter_document_text(upload.source, upload.filename)
+
+        if wants_stream(request.form.get('stream')):
+            response = sse_response(stream_document_analysis(
+                content,
+                'Sorry, I encountered an issue processing your document. Please try again with a different document or format.',
+                document_id,
+                session,
+                file.filename
+            ))
+            response.call_on_close(upload.close)
+            return response
 
         try:
-            if filename.endswith('.pdf'):
-                print("Processing PDF file")
-                # Usamos PyPDF2 directamente en lugar de LangChain loader
-                pdf_reader = PdfReader(file_path)
-                for page in pdf_reader.pages:
-                    content += page.extract_text() + "\n"
-                print(f"Extracted {len(pdf_reader.pages)} pages from PDF")
-
-            elif filename.endswith('.docx'):
-                print("Processing DOCX file")
-                # Usamos docx2txt en vez de LangChain loader
-                content = docx2txt.process(file_path)
-                print("DOCX content extracted")
-
-            elif filename.endswith('.txt'):
-                print("Processing TXT file")
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = f.read()
-                print("TXT content extracted")
-            else:
-                print(f"Unsupported file format: {filename}")
-                return jsonify({'response': 'Unsupported file format. Please upload PDF, DOCX, or TXT files.'}), 200
+            # ALWAYS use chunking regardless of document size
+            index_id = document_index_id(document_id, session, file.filename)
+            response_content = analyze_document(content, document_id=version_key, index_id=index_id)
         finally:
-            # Clean up the file after processing
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Temporary file {file_path} removed")
-
-        # ALWAYS use chunking regardless of document size
-        print("Splitting document into chunks")
-        chunks = split_text(content)
-        print(f"Document split into {len(chunks)} chunks")
-
-        # Process chunks
-        print("Processing chunks")
-        chunk_analyses = []
-        for i, chunk in enumerate(chunks):
-            print(f"Processing chunk {i+1}/{len(chunks)}")
-            chunk_content = get_chunk_analysis(
-                chunk,
-                i+1,
-                len(chunks)
-            )
-            chunk_analyses.append(chunk_content)
-
-        # Combine analyses
-        print("Combining chunk analyses for final analysis")
-        combined_analysis = "\n\n".join(chunk_analyses)
-        response_content = get_final_analysis(combined_analysis)
-
-        print(f"Final analysis response generated: {response_content[:100]}...")
-        return jsonify({'response': response_content})
+            upload.close()
+        attach_document(session, file.filename, response_content, index_id)
 
+        logger.debug(f"Final analysis response generated: {response_content[:100]}...")
+        return jsonify(document_response(response_content, document_id, session))
+
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
     except Exception as e:
-        error_traceback = traceback.format_exc()
-        print(f"Unhandled error in /api/document-upload: {str(e)}")
-        print(error_traceback)
+        logger.exception(f"Unhandled error in /api/document-upload: {str(e)}")
         # Generic message without technical details
         return jsonify({'response': 'Sorry, I encountered an issue processing your document. Please try again with a different document or format.'}), 200
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and progress of a queued document analysis"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    response_data = {
+        'jobId': job['id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'progress': {'done': job['done'], 'total': job['total']}
+    }
+    if job['status'] == 'done':
+        response_data['response'] = job['result']
+    elif job['status'] == 'failed':
+        response_data['response'] = 'Sorry, I encountered an issue processing your document. Please try again with a different document or format.'
+    return jsonify(response_data)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Final analysis of a finished job, in the /api/document-upload format"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'done':
+        return jsonify({'response': job['result']})
+    if job['status'] == 'failed':
+        return jsonify({'response': 'Sorry, I encountered an issue processing your document. Please try again with a different document or format.'}), 200
+    return jsonify({'status': job['status'], 'statusUrl': f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/batch-analysis', methods=['POST'])
+def batch_analysis():
+    """Analyze many documents at once, streaming one NDJSON line per document.
+
+    Accepts several 'files' fields and/or .zip/.tar archives of documents.
+    """
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        logger.warning("No files in batch request")
+        return jsonify({'error': 'No files'}), 400
+
+    # Archives (and their buffers) to release once the batch is done
+    opened = []
+    try:
+        rate_limiter.admit('bulk')
+
+        # Documents are only buffered when a worker picks them up, so a batch
+        # that is too large is turned away before holding any of them in memory
+        documents = []
+        skipped = []
+        for file in files:
+            if is_archive(file.filename):
+                # Only the archive itself is buffered, to read its member list
+                with span('upload_save'):
+                    archive_upload = UploadBuffer(file.stream, file.filename)
+                opened.append(archive_upload)
+                archive = ArchiveReader(archive_upload.source, file.filename)
+                opened.insert(0, archive)
+                for name in archive.names:
+                    if is_supported_file(name):
+                        documents.append((name, functools.partial(archive.open, name)))
+                    else:
+                        skipped.append(name)
+            elif is_supported_file(file.filename):
+                documents.append((file.filename, functools.partial(UploadBuffer, file.stream, file.filename)))
+            else:
+                skipped.append(file.filename)
+            if len(documents) > BATCH_MAX_FILES:
+                break
+
+        if len(documents) > BATCH_MAX_FILES:
+            for item in opened:
+                item.close()
+            return jsonify({'error': f'Too many documents: at most {BATCH_MAX_FILES} per batch'}), 400
+        logger.info(f"Batch of {len(documents)} documents ({len(skipped)} skipped)")
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        for item in opened:
+            item.close()
+        logger.exception(f"Unhandled error in /api/batch-analysis: {str(e)}")
+        return jsonify({'response': 'Sorry, I encountered an issue processing your documents. Please try again with a different archive or format.'}), 200
+
+    def results():
+        failed = 0
+        try:
+            for name in skipped:
+                yield json.dumps({'filename': name, 'status': 'skipped',
+                                  'response': 'Unsupported file format. Please upload PDF, DOCX, or TXT files.'}) + '\n'
+            for result in iter_batch_results(documents):
+                if result['status'] == 'failed':
+                    failed += 1
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'status': 'complete', 'documents': len(documents),
+                              'failed': failed, 'skipped': len(skipped)}) + '\n'
+        finally:
+            for item in opened:
+                item.close()
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
 @app.route('/api/download-template', methods=['POST'])
 def download_template():
     try:
-        print("Received request to /api/download-template")
         data = request.json
-        print(f"Request data: {data}")
         template_content = data.get('template')
         template_type = data.get('templateType', 'legal_document')
 
         if not template_content:
-            print("Error: Missing template content")
+            logger.warning("Missing template content")
             return jsonify({'response': 'Missing template content'}), 200
 
-        print(f"Creating Word document for {template_type}")
-        # Create Word document
-        doc = Document()
-        for line in template_content.split('\n'):
-            doc.add_paragraph(line)
-
-        # Save to temporary file
-        temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".docx")
-        print(f"Saving template to temporary file: {temp_path.name}")
-        doc.save(temp_path.name)
+        logger.info(f"Creating Word document for {template_type}")
+        with span('docx_build'):
+            # Built in memory from a cached document skeleton; nothing touches the disk
+            buffer = build_docx(template_content)
 
         return send_file(
-            temp_path.name,
+            buffer,
             as_attachment=True,
             download_name=f"{template_type.replace(' ', '_')}_template.docx",
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
         )
     except Exception as e:
-        error_traceback = traceback.format_exc()
-        print(f"Unhandled error in /api/download-template: {str(e)}")
-        print(error_traceback)
+        logger.exception(f"Unhandled error in /api/download-template: {str(e)}")
         # Generic message without technical details
         return jsonify({'response': 'Sorry, I encountered an issue creating your template document. Please try again later.'}), 200
 
+@app.cli.command('prewarm-templates')
+def prewarm_templates():
+    """Generate the common legal templates ahead of the first request"""
+    warmed = template_store.prewarm(COMMON_TEMPLATE_TYPES)
+    print(f"Pre-warmed {len(warmed)}/{len(COMMON_TEMPLATE_TYPES)} templates: {', '.join(warmed)}")
+
 if __name__ == '__main__':
+    start_background_work()
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
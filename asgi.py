@@ -0,0 +1,685 @@
+"""Asyncio (ASGI) serving mode.
+
+/api/chat, /api/document-upload and /status are served by coroutines that
+await non-blocking LLM calls, so one process can hold hundreds of concurrent
+conversations without a thread per request. Every other route (the UI, job
+status, template download, metrics) is passed through to the Flask app.
+Routes, request fields and JSON responses are the same as in app.py.
+
+Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextvars
+import io
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as legal_app
+from utils.cache import make_key
+from utils.llm_client import create_backend, LLMError
+from utils.extraction import UploadBuffer
+from utils.logging_config import request_id_var
+from utils.metrics import metrics, span
+from utils.rate_limit import RateLimitExceeded
+from utils.template_store import normalize_document_type
+
+logger = legal_app.logger
+
+# The event loop replaces the thread pool, so far more calls can be in flight
+ASGI_MAX_CONCURRENT_LLM_CALLS = int(os.getenv('ASGI_MAX_CONCURRENT_LLM_CALLS', 256))
+
+async_llm = create_backend(
+    legal_app.LLM_BACKEND,
+    asynchronous=True,
+    url=legal_app.LLM_API_URL,
+    model=legal_app.LLM_MODEL,
+    pool_size=ASGI_MAX_CONCURRENT_LLM_CALLS,
+    timeout=legal_app.LLM_TIMEOUT,
+    max_retries=legal_app.LLM_MAX_RETRIES
+)
+llm_slots = asyncio.Semaphore(ASGI_MAX_CONCURRENT_LLM_CALLS)
+
+CONSULT_ERROR = 'Sorry, I encountered an issue answering your legal question. Please try again or rephrase your question.'
+ANALYSIS_ERROR = 'Sorry, I encountered an issue analyzing this document. Please try again with a different document or format.'
+UPLOAD_ERROR = 'Sorry, I encountered an issue processing your document. Please try again with a different document or format.'
+QUESTION_ERROR = 'Sorry, I encountered an issue answering your question about this document. Please try again.'
+TEMPLATE_ERROR = 'Sorry, I encountered an issue creating this template. Please try a different template type or check your request.'
+UNEXPECTED_ERROR = 'Sorry, an unexpected error occurred. Please try again.'
+
+
+async def acquire_token(priority='interactive'):
+    # Same token bucket and priority queue as the Flask workers, waited on the event loop
+    await legal_app.rate_limiter.acquire_async(priority)
+
+
+async def _chat(prompt, stage, priority='interactive', **kwargs):
+    async with llm_slots:
+        await acquire_token(priority)
+        with span(stage):
+            return await async_llm.chat(prompt, temperature=legal_app.LLM_TEMPERATURE, **kwargs)
+
+
+async def in_thread(fn, *args):
+    """Run a blocking call in a thread, in the request's context.
+
+    Used for the SQLite-backed stores (sessions, caches, versions, jobs, templates):
+    a locked database must stall one request, not the event loop.
+    """
+    return await asyncio.to_thread(contextvars.copy_context().run, fn, *args)
+
+
+async def record_exchange(session, query, answer):
+    # May call the LLM to fold old turns into the summary
+    await in_thread(legal_app.record_exchange, session, query, answer)
+
+
+async def get_consultation_response(query, session=None):
+    context = legal_app.session_context(session)
+    if not context:
+        cached = legal_app.consultation_cache.get(query, legal_app.CONSULT_CACHE_NAMESPACE)
+        if cached is not None:
+            if session is not None:
+                await record_exchange(session, query, cached)
+            return cached
+
+    try:
+        prompt = legal_app.legal_consultation_template.format(query=query, context=context)
+        response = await _chat(prompt, 'consultation')
+        if not context:
+            legal_app.consultation_cache.set(query, response, legal_app.CONSULT_CACHE_NAMESPACE)
+        if session is not None:
+            await record_exchange(session, query, response)
+        return response
+    except Exception as e:
+        logger.error(f"Error en consulta: {str(e)}")
+        return "Lo siento, ocurrió un error al procesar tu consulta."
+
+
+async def document_question_prompt(question, document_id=None, session=None):
+    # Clause search decodes stored vectors: keep it off the event loop
+    return await in_thread(legal_app.document_question_prompt, question, document_id, session)
+
+
+async def get_document_answer(question, document_id=None, session=None):
+    try:
+        prompt = await document_question_prompt(question, document_id, session)
+        if prompt is None:
+            return legal_app.NO_DOCUMENT_ANSWER
+        cache_key = make_key(prompt, legal_app.document_question_template,
+                             legal_app.llm_client.model, legal_app.LLM_TEMPERATURE)
+        answer = await in_thread(legal_app.response_cache.get, cache_key)
+        if answer is None:
+            answer = await _chat(prompt, 'document_question')
+            await in_thread(legal_app.response_cache.set, cache_key, answer)
+        if session is not None:
+            await record_exchange(session, question, answer)
+        return answer
+    except Exception as e:
+        logger.error(f"Error en pregunta sobre documento: {str(e)}")
+        return "Lo siento, ocurrió un error al procesar tu pregunta."
+
+
+async def get_chunk_analysis(document_chunk, chunk_num, total_chunks):
+    cache_key = legal_app._chunk_analysis_key(document_chunk)
+    cached = await in_thread(legal_app.response_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        prompt = legal_app._chunk_analysis_prompt(document_chunk, chunk_num, total_chunks)
+
+        async def analyze():
+            analysis = await _chat(prompt, 'chunk_analysis', priority='bulk')
+            await in_thread(legal_app.response_cache.set, cache_key, analysis)
+            return analysis
+
+        return await legal_app.llm_flights.do_async(cache_key, analyze)
+    except Exception as e:
+        logger.error(f"Error en análisis de chunk: {str(e)}")
+        return f"Error procesando chunk {chunk_num}"
+
+
+async def get_merged_analysis(partial_analyses, part_range):
+    joined = "\n\n".join(partial_analyses)
+    if len(partial_analyses) == 1:
+        return joined
+    cache_key = legal_app._merge_analysis_key(joined)
+    cached = await in_thread(legal_app.response_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        prompt = legal_app.document_merge_analysis_template.format(
+            partial_analyses=joined,
+            part_range=part_range
+        )
+        merged = await _chat(prompt, 'merge_analysis', priority='bulk')
+        await in_thread(legal_app.response_cache.set, cache_key, merged)
+        return merged
+    except Exception as e:
+        logger.warning(f"Error merging analyses {part_range}: {str(e)}")
+        return joined
+
+
+async def reduce_analyses(analyses, fan_in=legal_app.REDUCE_FAN_IN,
+                          max_tokens=legal_app.MAX_REDUCE_INPUT_TOKENS):
+    """Async counterpart of app.reduce_analyses: each level's groups are gathered"""
+    spans = [(i + 1, i + 1) for i in range(len(analyses))]
+    combined_tokens = legal_app.count_tokens("\n\n".join(analyses))
+
+    while len(analyses) > 1 and combined_tokens > max_tokens:
+        groups = [analyses[i:i + fan_in] for i in range(0, len(analyses), fan_in)]
+        group_spans = [(spans[i][0], spans[min(i + fan_in, len(spans)) - 1][1])
+                       for i in range(0, len(spans), fan_in)]
+        merged = await asyncio.gather(*(
+            get_merged_analysis(group, f"parts {start}-{end}")
+            for group, (start, end) in zip(groups, group_spans)
+        ))
+        merged_tokens = legal_app.count_tokens("\n\n".join(merged))
+        if merged_tokens >= combined_tokens:
+            break
+        analyses, spans, combined_tokens = list(merged), group_spans, merged_tokens
+
+    return "\n\n".join(analyses)
+
+
+async def get_final_analysis(document_key_info):
+    cache_key = legal_app._final_analysis_key(document_key_info)
+    cached = await in_thread(legal_app.response_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        prompt = legal_app.document_final_analysis_template.format(document_key_info=document_key_info)
+        analysis = await _chat(prompt, 'final_analysis')
+        await in_thread(legal_app.response_cache.set, cache_key, analysis)
+        return analysis
+    except Exception as e:
+        logger.error(f"Error en análisis final: {str(e)}")
+        return "Error en análisis final"
+
+
+async def stream_final_analysis(document_key_info):
+    cache_key = legal_app._final_analysis_key(document_key_info)
+    cached = await in_thread(legal_app.response_cache.get, cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    try:
+        prompt = legal_app.document_final_analysis_template.format(document_key_info=document_key_info)
+        parts = []
+        async with llm_slots:
+            await acquire_token()
+            async for text in async_llm.chat_stream(prompt, temperature=legal_app.LLM_TEMPERATURE):
+                parts.append(text)
+                yield text
+        await in_thread(legal_app.response_cache.set, cache_key, ''.join(parts))
+    except LLMError as e:
+        logger.error(f"Error en análisis final: {str(e)}")
+        yield "Error en análisis final"
+
+
+async def get_template(document_type):
+    cached = await in_thread(legal_app.template_store.lookup, document_type)
+    if cached is not None:
+        return cached
+
+    try:
+        _, canonical = normalize_document_type(document_type)
+        prompt = legal_app.legal_template_generator.format(document_type=canonical)
+        flight_key = make_key(prompt, legal_app.legal_template_generator,
+                              legal_app.llm_client.model, legal_app.LLM_TEMPERATURE)
+        content = await legal_app.llm_flights.do_async(flight_key, lambda: _chat(prompt, 'get_template'))
+        await in_thread(legal_app.template_store.put, document_type, content)
+        return content
+    except Exception as e:
+        logger.error(f"Error generando template: {str(e)}")
+        return "Error generando template"
+
+
+async def split_document(content, document_id=None):
+    """Chunk text (or extracted pieces) off the event loop; chunking is CPU-bound"""
+    def split():
+        if document_id:
+            return legal_app.version_chunks(content, document_id)
+        with span('split_text'):
+            if isinstance(content, str):
+                return legal_app.split_text(content)
+            return list(legal_app.iter_split_text(content))
+    return await in_thread(split)
+
+
+async def iter_chunk_analyses(chunks):
+    """Yield (index, analysis) as chunks finish, at most CHUNK_WORKERS_PER_REQUEST at a time"""
+    request_slots = asyncio.Semaphore(legal_app.CHUNK_WORKERS_PER_REQUEST)
+    total_chunks = len(chunks)
+
+    async def analyze(index, chunk):
+        async with request_slots:
+            return index, await get_chunk_analysis(chunk, index + 1, total_chunks)
+
+    tasks = [asyncio.ensure_future(analyze(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def analyze_document(content, document_id=None, index_id=None):
+    index_id = index_id or document_id
+    chunks = await split_document(content, document_id)
+    chunk_analyses = [None] * len(chunks)
+    async for index, analysis in iter_chunk_analyses(chunks):
+        chunk_analyses[index] = analysis
+    if document_id:
+        await in_thread(legal_app.record_document_version, document_id, chunks, chunk_analyses)
+    if index_id:
+        legal_app.index_document(index_id, chunks)
+    with span('reduce'):
+        combined_analysis = await reduce_analyses(chunk_analyses)
+    return await get_final_analysis(combined_analysis)
+
+
+async def stream_document_analysis(content, error_message, document_id=None, session=None, name=None):
+    sse_event = legal_app.sse_event
+    try:
+        done_data = {'sessionId': session['id']} if session is not None else {}
+        index_id = legal_app.document_index_id(document_id, session, name)
+        version_key = legal_app.document_key(session, document_id) if document_id and session is not None else None
+        chunks = await split_document(content, version_key)
+        total_chunks = len(chunks)
+        chunk_analyses = [None] * total_chunks
+        done = 0
+        async for index, analysis in iter_chunk_analyses(chunks):
+            chunk_analyses[index] = analysis
+            done += 1
+            yield sse_event('progress', {
+                'stage': 'chunk',
+                'done': done,
+                'total': total_chunks,
+                'message': f"chunk {done}/{total_chunks} done"
+            })
+
+        if version_key:
+            version = await in_thread(legal_app.record_document_version, version_key, chunks, chunk_analyses)
+            done_data.update({'documentId': document_id, 'version': version})
+        if index_id:
+            legal_app.index_document(index_id, chunks)
+
+        yield sse_event('progress', {'stage': 'reduce'})
+        combined_analysis = await reduce_analyses(chunk_analyses)
+        yield sse_event('progress', {'stage': 'final'})
+        parts = []
+        async for text in stream_final_analysis(combined_analysis):
+            parts.append(text)
+            yield sse_event('token', {'text': text})
+        if session is not None:
+            await in_thread(legal_app.attach_document, session, name or document_id or 'Pasted document', ''.join(parts), index_id)
+        yield sse_event('done', done_data)
+    except Exception as e:
+        logger.exception(f"Error in streamed document analysis: {str(e)}")
+        yield sse_event('error', {'response': error_message})
+
+
+async def stream_text(texts, done_data=None):
+    sse_event = legal_app.sse_event
+    try:
+        async for text in texts:
+            yield sse_event('token', {'text': text})
+        yield sse_event('done', done_data or {})
+    except Exception as e:
+        logger.exception(f"Error in streamed response: {str(e)}")
+        yield sse_event('error', {'response': UNEXPECTED_ERROR})
+
+
+async def stream_consultation_response(query, session=None):
+    context = legal_app.session_context(session)
+    if not context:
+        cached = legal_app.consultation_cache.get(query, legal_app.CONSULT_CACHE_NAMESPACE)
+        if cached is not None:
+            yield cached
+            if session is not None:
+                await record_exchange(session, query, cached)
+            return
+
+    try:
+        prompt = legal_app.legal_consultation_template.format(query=query, context=context)
+        parts = []
+        async with llm_slots:
+            await acquire_token()
+            async for text in async_llm.chat_stream(prompt, temperature=legal_app.LLM_TEMPERATURE):
+                parts.append(text)
+                yield text
+        response = ''.join(parts)
+        if not context:
+            legal_app.consultation_cache.set(query, response, legal_app.CONSULT_CACHE_NAMESPACE)
+        if session is not None:
+            await record_exchange(session, query, response)
+    except LLMError as e:
+        logger.error(str(e))
+        yield "Lo siento, ocurrió un error al procesar tu consulta."
+
+
+async def stream_document_answer(question, document_id=None, session=None):
+    prompt = await document_question_prompt(question, document_id, session)
+    if prompt is None:
+        yield legal_app.NO_DOCUMENT_ANSWER
+        return
+    cache_key = make_key(prompt, legal_app.document_question_template,
+                         legal_app.llm_client.model, legal_app.LLM_TEMPERATURE)
+    answer = await in_thread(legal_app.response_cache.get, cache_key)
+    if answer is not None:
+        yield answer
+    else:
+        try:
+            parts = []
+            async with llm_slots:
+                await acquire_token()
+                async for text in async_llm.chat_stream(prompt, temperature=legal_app.LLM_TEMPERATURE):
+                    parts.append(text)
+                    yield text
+            answer = ''.join(parts)
+            await in_thread(legal_app.response_cache.set, cache_key, answer)
+        except LLMError as e:
+            logger.error(str(e))
+            yield "Lo siento, ocurrió un error al procesar tu pregunta."
+            return
+    if session is not None:
+        await record_exchange(session, question, answer)
+
+
+async def stream_template(document_type):
+    cached = await in_thread(legal_app.template_store.lookup, document_type)
+    if cached is not None:
+        yield cached
+        return
+
+    try:
+        _, canonical = normalize_document_type(document_type)
+        prompt = legal_app.legal_template_generator.format(document_type=canonical)
+        parts = []
+        async with llm_slots:
+            await acquire_token()
+            with span('get_template'):
+                async for text in async_llm.chat_stream(prompt, temperature=legal_app.LLM_TEMPERATURE):
+                    parts.append(text)
+                    yield text
+        await in_thread(legal_app.template_store.put, document_type, ''.join(parts))
+    except LLMError as e:
+        logger.error(f"Error generando template: {str(e)}")
+        yield "Error generando template"
+
+
+def sse_response(events):
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def rate_limited_response(error):
+    return JSONResponse(
+        {'response': 'The service is busy right now. Please try again in a moment.'},
+        status_code=503,
+        headers={'Retry-After': str(error.retry_after)}
+    )
+
+
+def _wants_stream(request, flag=None):
+    if flag is not None and str(flag).lower() in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in request.headers.get('accept', '')
+
+
+async def status(request):
+    """Simple endpoint to check API connectivity"""
+    try:
+        text = await async_llm.chat("Hello", max_tokens=5, temperature=None, timeout=10)
+        return PlainTextResponse(f"API connection working! Response: {text}")
+    except LLMError as e:
+        if e.status_code is not None:
+            return PlainTextResponse(f"API error: {e.status_code} - {e.body}")
+        return PlainTextResponse(f"API connection error: {str(e)}")
+    except Exception as e:
+        return PlainTextResponse(f"API connection error: {str(e)}")
+
+
+async def chat(request):
+    try:
+        data = await request.json()
+        message = data.get('message')
+        feature = data.get('feature', 'legal-consult')
+        stream = _wants_stream(request, data.get('stream'))
+
+        logger.info(f"Chat request: feature={feature} message_chars={len(message or '')} stream={stream}")
+
+        if not message:
+            logger.warning("Missing message parameter")
+            return JSONResponse({'error': 'Missing message parameter'}, status_code=400)
+
+        legal_app.rate_limiter.admit('bulk' if feature == 'document-analysis' else 'interactive')
+
+        session = None
+        if feature in ('legal-consult', 'document-analysis', 'document-question'):
+            session = await in_thread(legal_app.sessions.get_or_create, data.get('sessionId'))
+
+        if feature == 'legal-consult':
+            if stream:
+                return sse_response(stream_text(stream_consultation_response(message, session),
+                                                {'sessionId': session['id']}))
+            try:
+                return JSONResponse({'response': await get_consultation_response(message, session),
+                                     'sessionId': session['id']})
+            except Exception as e:
+                logger.exception(f"Error in consultation chain: {str(e)}")
+                return JSONResponse({'response': CONSULT_ERROR})
+
+        elif feature == 'document-analysis':
+            document_id = data.get('documentId') or None
+            if stream:
+                return sse_response(stream_document_analysis(message, ANALYSIS_ERROR, document_id, session))
+            try:
+                index_id = legal_app.document_index_id(document_id, session)
+                version_key = legal_app.document_key(session, document_id) if document_id else None
+                analysis = await analyze_document(message, version_key, index_id)
+                await in_thread(legal_app.attach_document, session, document_id or 'Pasted document', analysis, index_id)
+                return JSONResponse(await in_thread(legal_app.document_response, analysis, document_id, session))
+            except Exception as e:
+                logger.exception(f"Error in document analysis: {str(e)}")
+                return JSONResponse({'response': ANALYSIS_ERROR})
+
+        elif feature == 'document-question':
+            document_id = data.get('documentId') or None
+            if stream:
+                return sse_response(stream_text(stream_document_answer(message, document_id, session),
+                                                {'sessionId': session['id']}))
+            try:
+                return JSONResponse({'response': await get_document_answer(message, document_id, session),
+                                     'sessionId': session['id']})
+            except Exception as e:
+                logger.exception(f"Error answering document question: {str(e)}")
+                return JSONResponse({'response': QUESTION_ERROR})
+
+        elif feature == 'legal-templates':
+            response_text = f"I've created a {message} template for you. You can use this as a starting point and customize it to your specific needs."
+            if stream:
+                return sse_response(stream_text(stream_template(message), {
+                    'response': response_text,
+                    'templateType': message
+                }))
+            try:
+                template_content = await get_template(message)
+                return JSONResponse({
+                    'response': response_text,
+                    'template': template_content,
+                    'templateType': message
+                })
+            except Exception as e:
+                logger.exception(f"Error in template generation for '{message}': {str(e)}")
+                return JSONResponse({'response': TEMPLATE_ERROR})
+
+        else:
+            logger.warning(f"Invalid feature specified: {feature}")
+            return JSONResponse({'error': 'Invalid feature specified'}, status_code=400)
+
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        logger.exception(f"Unhandled error in /api/chat: {str(e)}")
+        return JSONResponse({'response': UNEXPECTED_ERROR})
+
+
+async def document_upload(request):
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        logger.warning("No file part in request")
+        return JSONResponse({'error': 'No file part'}, status_code=400)
+
+    if not file.filename:
+        logger.warning("No selected file")
+        return JSONResponse({'error': 'No selected file'}, status_code=400)
+
+    if not legal_app.is_supported_file(file.filename):
+        logger.warning(f"Unsupported file format: {file.filename.lower()}")
+        return JSONResponse({'response': 'Unsupported file format. Please upload PDF, DOCX, or TXT files.'})
+
+    document_id = form.get('documentId') or None
+
+    try:
+        session = await in_thread(legal_app.sessions.get_or_create, form.get('sessionId'))
+        version_key = legal_app.document_key(session, document_id) if document_id else None
+
+        if str(form.get('async', '')).lower() in ('1', 'true', 'yes'):
+            os.makedirs(legal_app.JOB_UPLOAD_DIR, exist_ok=True)
+            extension = os.path.splitext(file.filename)[1].lower()
+            job_path = os.path.join(legal_app.JOB_UPLOAD_DIR, uuid.uuid4().hex + extension)
+            data = await file.read()
+
+            def submit():
+                with open(job_path, 'wb') as f:
+                    f.write(data)
+                return legal_app.job_queue.submit({
+                    'path': job_path,
+                    'filename': file.filename,
+                    'document_id': version_key,
+                    'index_id': legal_app.document_index_id(document_id, session, file.filename),
+                    'session_id': session['id']
+                })
+
+            job_id = await in_thread(submit)
+            logger.info(f"Queued document job {job_id} for {file.filename}")
+            return JSONResponse({
+                'jobId': job_id,
+                'status': 'queued',
+                'statusUrl': f"/api/jobs/{job_id}",
+                'sessionId': session['id']
+            }, status_code=202)
+
+        legal_app.rate_limiter.admit('bulk')
+
+        with span('upload_save'):
+            upload = UploadBuffer(io.BytesIO(await file.read()), file.filename)
+
+        def extract():
+            return list(legal_app.iter_document_text(upload.source, upload.filename))
+
+        # PDF/DOCX parsing is CPU-bound: keep it off the event loop
+        try:
+            pieces = await in_thread(extract)
+        finally:
+            upload.close()
+
+        if _wants_stream(request, form.get('stream')):
+            return sse_response(stream_document_analysis(pieces, UPLOAD_ERROR, document_id, session, file.filename))
+
+        index_id = legal_app.document_index_id(document_id, session, file.filename)
+        analysis = await analyze_document(pieces, version_key, index_id)
+        await in_thread(legal_app.attach_document, session, file.filename, analysis, index_id)
+        return JSONResponse(await in_thread(legal_app.document_response, analysis, document_id, session))
+
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
+    except Exception as e:
+        logger.exception(f"Unhandled error in /api/document-upload: {str(e)}")
+        return JSONResponse({'response': UPLOAD_ERROR})
+
+
+class RequestIdMiddleware:
+    """Tag async requests with a request ID, as app.start_request does for Flask"""
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.asgi_app(scope, receive, send)
+
+        headers = dict(scope.get('headers') or [])
+        request_id = headers.get(b'x-request-id', b'').decode('latin-1') or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + [(b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.asgi_app(scope, receive, send_with_id)
+        finally:
+            path = scope['path']
+            # Requests passed through to Flask are observed by its after_request hook
+            if path in ASYNC_ROUTES:
+                elapsed = time.perf_counter() - started
+                metrics.observe('http_request_duration_seconds', elapsed,
+                                endpoint=path, method=scope['method'], status=status_code)
+                logger.info(f"{scope['method']} {path} -> {status_code} in {elapsed * 1000:.1f} ms")
+            request_id_var.reset(token)
+
+
+async def close_clients():
+    await async_llm.aclose()
+
+
+@asynccontextmanager
+async def lifespan(_):
+    legal_app.start_background_work()
+    try:
+        yield
+    finally:
+        await close_clients()
+
+
+# Paths served natively; the rest is passed through to the Flask app
+ASYNC_ROUTES = ('/status', '/api/chat', '/api/document-upload')
+
+starlette_app = Starlette(
+    routes=[
+        Route('/status', status, methods=['GET']),
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/document-upload', document_upload, methods=['POST']),
+        # Everything else (UI, jobs, downloads, metrics) is served by Flask in a thread
+        Mount('/', app=WSGIMiddleware(legal_app.app)),
+    ],
+    lifespan=lifespan,
+)
+
+app = RequestIdMiddleware(starlette_app)
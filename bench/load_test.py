@@ -0,0 +1,215 @@
+"""Concurrent load test for the Legal Guardian HTTP API.
+
+Drives /api/chat (all three features), /api/document-upload and
+/api/download-template with synthetic requests and reports throughput,
+latency percentiles and, when the app runs against bench/mock_llm_server.py,
+the number of LLM calls each request needed.
+
+    python -m bench.mock_llm_server --port 8001 &
+    LLM_API_URL=http://127.0.0.1:8001/v2/chat python app.py &
+    python -m bench.load_test --concurrency 16 --requests 200
+
+Inputs are randomized per request so the response caches do not hide the
+cost of the pipeline; pass --repeat-inputs to measure the cached path.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CLAUSES = (
+    "The Receiving Party shall hold the Confidential Information in strict confidence.",
+    "Either party may terminate this Agreement upon thirty (30) days written notice.",
+    "The Employee shall be paid an annual salary payable in accordance with payroll practice.",
+    "This Agreement shall be governed by the laws of the State of Delaware.",
+    "The Tenant shall not sublet the Premises without the prior written consent of the Landlord.",
+    "Neither party shall be liable for indirect or consequential damages.",
+)
+QUESTIONS = (
+    "How do I terminate a lease early?",
+    "What is the statute of limitations for breach of contract?",
+    "Can my employer change my contract without notice?",
+    "What makes a non-compete clause enforceable?",
+)
+TEMPLATE_TYPES = ('NDA', 'Employment Contract', 'Will', 'Power of Attorney', 'Lease Agreement')
+
+
+def synthetic_document(sections, rng, salt=''):
+    lines = []
+    for number in range(1, sections + 1):
+        lines.append(f"ARTICLE {number} - PROVISIONS {salt}")
+        lines.extend(rng.choice(CLAUSES) for _ in range(rng.randint(4, 12)))
+    return '\n'.join(lines)
+
+
+class Scenario:
+    def __init__(self, name, send):
+        self.name = name
+        self.send = send
+
+
+def build_scenarios(base_url, doc_sections, repeat_inputs):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=256)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def salt():
+        return '' if repeat_inputs else uuid.uuid4().hex[:8]
+
+    def consult(rng):
+        question = rng.choice(QUESTIONS) + ('' if repeat_inputs else f" (case {salt()})")
+        return session.post(f"{base_url}/api/chat", json={'message': question, 'feature': 'legal-consult'})
+
+    def analysis(rng):
+        text = synthetic_document(doc_sections, rng, salt())
+        return session.post(f"{base_url}/api/chat", json={'message': text, 'feature': 'document-analysis'})
+
+    def templates(rng):
+        document_type = rng.choice(TEMPLATE_TYPES)
+        return session.post(f"{base_url}/api/chat", json={'message': document_type, 'feature': 'legal-templates'})
+
+    def upload(rng):
+        text = synthetic_document(doc_sections, rng, salt())
+        files = {'file': (f"contract-{uuid.uuid4().hex[:6]}.txt", text.encode('utf-8'), 'text/plain')}
+        return session.post(f"{base_url}/api/document-upload", files=files)
+
+    def download(rng):
+        template = '\n'.join(rng.choice(CLAUSES) for _ in range(200))
+        return session.post(f"{base_url}/api/download-template",
+                            json={'template': template, 'templateType': 'Benchmark Agreement'})
+
+    return [
+        Scenario('chat:legal-consult', consult),
+        Scenario('chat:document-analysis', analysis),
+        Scenario('chat:legal-templates', templates),
+        Scenario('document-upload', upload),
+        Scenario('download-template', download),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def mock_calls(mock_url):
+    if not mock_url:
+        return None
+    try:
+        return requests.get(f"{mock_url}/stats", timeout=5).json()['calls']
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+
+def run_scenario(scenario, total_requests, concurrency, mock_url, seed):
+    def one(index):
+        rng = random.Random(seed + index)
+        started = time.perf_counter()
+        try:
+            response = scenario.send(rng)
+            response.content  # make sure the body is fully received
+            ok = response.status_code == 200 and not _is_error_payload(response)
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    calls_before = mock_calls(mock_url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(total_requests)))
+    elapsed = time.perf_counter() - started
+    calls_after = mock_calls(mock_url)
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    llm_calls = None
+    if calls_before is not None and calls_after is not None:
+        llm_calls = (calls_after - calls_before) / total_requests
+
+    return {
+        'scenario': scenario.name,
+        'requests': total_requests,
+        'errors': errors,
+        'throughput_rps': total_requests / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'llm_calls_per_request': llm_calls,
+    }
+
+
+# How the app words the failures it reports with a 200 (see app.py and asgi.py)
+ERROR_PREFIXES = (
+    'Sorry',
+    'Lo siento, ocurrió un error',
+    'Error en análisis final',
+    'Error procesando chunk',
+    'Unsupported file format',
+    'Missing template content',
+)
+TEMPLATE_ERROR = 'Error generando template'
+
+
+def _is_error_payload(response):
+    # The app reports most failures as 200 with an apology in 'response'
+    if 'application/json' not in response.headers.get('Content-Type', ''):
+        return False
+    try:
+        payload = response.json()
+    except ValueError:
+        return True
+    if payload.get('template') == TEMPLATE_ERROR:
+        return True
+    return str(payload.get('response', '')).startswith(ERROR_PREFIXES)
+
+
+def print_report(results):
+    header = f"{'scenario':<26}{'reqs':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'LLM/req':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        llm = f"{r['llm_calls_per_request']:.2f}" if r['llm_calls_per_request'] is not None else 'n/a'
+        print(f"{r['scenario']:<26}{r['requests']:>6}{r['errors']:>8}{r['throughput_rps']:>9.2f}"
+              f"{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}{llm:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Legal Guardian load test')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--mock-url', default='http://127.0.0.1:8001',
+                        help='mock LLM server used to count LLM calls ("" to disable)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    parser.add_argument('--doc-sections', type=int, default=40, help='articles per synthetic document')
+    parser.add_argument('--scenario', action='append', help='run only these scenarios')
+    parser.add_argument('--repeat-inputs', action='store_true', help='reuse inputs so caches can hit')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    base_url = args.base_url.rstrip('/')
+    mock_url = args.mock_url.rstrip('/') if args.mock_url else None
+    scenarios = build_scenarios(base_url, args.doc_sections, args.repeat_inputs)
+    if args.scenario:
+        scenarios = [s for s in scenarios if s.name in args.scenario]
+        if not scenarios:
+            parser.error('no matching scenarios')
+
+    results = [run_scenario(s, args.requests, args.concurrency, mock_url, args.seed) for s in scenarios]
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(r['errors'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
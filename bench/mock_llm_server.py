@@ -0,0 +1,164 @@
+"""Local stand-in for the Cohere v2 chat API.
+
+Speaks enough of the protocol (plain and streamed responses) for the app to
+run against it unchanged, with configurable latency, error rate and token
+rate. Point the app at it with:
+
+    python -m bench.mock_llm_server --port 8001 --latency 0.8 --error-rate 0.02
+    LLM_API_URL=http://127.0.0.1:8001/v2/chat python app.py
+
+GET /stats returns the number of chat calls served; POST /stats/reset zeroes it.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FILLER_WORDS = (
+    'the', 'party', 'shall', 'agreement', 'notice', 'term', 'clause', 'obligation',
+    'liability', 'confidential', 'termination', 'provision', 'payment', 'governing',
+)
+
+
+class MockState:
+    def __init__(self, latency, jitter, error_rate, tokens_per_second, response_tokens):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def count(self, error=False):
+        with self.lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+
+
+def _fake_tokens(prompt, count):
+    # Seeded by the prompt so identical prompts get identical answers
+    rng = random.Random(zlib.crc32(prompt.encode('utf-8')))
+    words = ['## Summary\n']
+    words.extend(rng.choice(FILLER_WORDS) + ' ' for _ in range(count))
+    return words
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.state.lock:
+                self._send_json(200, {'calls': self.state.calls, 'errors': self.state.errors})
+        else:
+            self._send_json(404, {'message': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b'{}'
+
+        if self.path == '/stats/reset':
+            with self.state.lock:
+                self.state.calls = 0
+                self.state.errors = 0
+            self._send_json(200, {'calls': 0, 'errors': 0})
+            return
+        if self.path != '/v2/chat':
+            self._send_json(404, {'message': 'not found'})
+            return
+
+        payload = json.loads(raw or b'{}')
+        state = self.state
+        time.sleep(max(0.0, random.gauss(state.latency, state.jitter)))
+
+        if random.random() < state.error_rate:
+            state.count(error=True)
+            status = random.choice([429, 500, 503])
+            self._send_json(status, {'message': 'mock failure'}, {'Retry-After': '0.1'})
+            return
+        state.count()
+
+        prompt = ''.join(m.get('content', '') for m in payload.get('messages', []))
+        token_count = min(payload.get('max_tokens', state.response_tokens), state.response_tokens)
+        tokens = _fake_tokens(prompt, token_count)
+        delay = 1.0 / state.tokens_per_second if state.tokens_per_second > 0 else 0
+
+        if payload.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for token in tokens:
+                time.sleep(delay)
+                event = {'type': 'content-delta', 'delta': {'message': {'content': {'text': token}}}}
+                self._write_chunk(f"event: content-delta\ndata: {json.dumps(event)}\n\n")
+            self._write_chunk('event: message-end\ndata: {"type": "message-end"}\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+
+        time.sleep(delay * len(tokens))
+        self._send_json(200, {
+            'id': 'mock',
+            'finish_reason': 'COMPLETE',
+            'message': {'role': 'assistant', 'content': [{'type': 'text', 'text': ''.join(tokens)}]}
+        })
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+def make_server(host='127.0.0.1', port=8001, latency=0.5, jitter=0.1, error_rate=0.0,
+                tokens_per_second=200.0, response_tokens=200):
+    state = MockState(latency, jitter, error_rate, tokens_per_second, response_tokens)
+    handler = type('ConfiguredMockChatHandler', (MockChatHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Cohere v2 chat server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='mean seconds before the first token')
+    parser.add_argument('--jitter', type=float, default=0.1, help='standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered 429/5xx')
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--response-tokens', type=int, default=200)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                         args.tokens_per_second, args.response_tokens)
+    print(f"Mock LLM server listening on http://{args.host}:{args.port}/v2/chat")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
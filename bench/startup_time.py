@@ -0,0 +1,134 @@
+"""Cold-start benchmark for Legal Guardian.
+
+Starts fresh interpreters that import app.py and serve a first request
+through Flask's test client, and reports the time spent importing, the
+time to the first response and the heaviest modules app.py imports (from
+``python -X importtime``). Thresholds make it usable as a regression check:
+
+    python -m bench.startup_time --runs 5 --max-import-ms 800
+
+With --chat, the first request is a consultation on /api/chat instead of /,
+which needs an LLM endpoint such as bench/mock_llm_server.py:
+
+    python -m bench.mock_llm_server --port 8001 --latency 0 &
+    python -m bench.startup_time --chat --llm-url http://127.0.0.1:8001/v2/chat
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+if sys.argv[1] == 'chat':
+    response = client.post('/api/chat', json={'message': 'What is a lease?', 'feature': 'legal-consult'})
+else:
+    response = client.get('/')
+answered = time.perf_counter()
+print(json.dumps({'import_s': imported - started, 'first_request_s': answered - imported,
+                  'status': response.status_code}))
+"""
+
+
+def parse_importtime(stderr, top=10):
+    """Heaviest direct imports of app.py as (module, cumulative seconds)"""
+    modules = []
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Two spaces of indentation per nesting level; a module's line comes
+        # after the lines of everything it imported
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1e6))
+        elif depth == 0:
+            if name.strip() == 'app':
+                modules = children
+            children = []
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return modules[:top]
+
+
+def run_once(chat, env):
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, 'chat' if chat else 'index'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"probe failed:\n{completed.stderr[-2000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_s'] = wall
+    result['imports'] = parse_importtime(completed.stderr)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Legal Guardian cold-start benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--chat', action='store_true', help='first request is a /api/chat consultation')
+    parser.add_argument('--llm-url', help='LLM_API_URL for the probe (e.g. the mock server)')
+    parser.add_argument('--top', type=int, default=10, help='heaviest imports to list')
+    parser.add_argument('--max-import-ms', type=float, help='fail if the median import time is above this')
+    parser.add_argument('--max-first-request-ms', type=float,
+                        help='fail if the median time from import to first response is above this')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ)
+        env.update({
+            'TEMPLATE_PREWARM': 'false',
+            'JOB_STORE_DB': os.path.join(scratch, 'jobs.sqlite3'),
+            'PYTHONDONTWRITEBYTECODE': '1',
+        })
+        if args.llm_url:
+            env['LLM_API_URL'] = args.llm_url
+        runs = [run_once(args.chat, env) for _ in range(args.runs)]
+
+    summary = {}
+    for key in ('import_s', 'first_request_s', 'process_s'):
+        values = [run[key] for run in runs]
+        summary[key] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+    summary['status'] = runs[-1]['status']
+    summary['imports'] = runs[-1]['imports'][:args.top]
+
+    print(f"{'measure':<24}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for key, label in (('import_s', 'import app'), ('first_request_s', 'first request'),
+                       ('process_s', 'process start to exit')):
+        stats = summary[key]
+        print(f"{label:<24}{stats['median'] * 1000:>12.1f}{stats['min'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}")
+    print(f"\nfirst response status: {summary['status']}")
+    print("\nheaviest imports of app.py (cumulative, last run):")
+    for module, seconds in summary['imports']:
+        print(f"  {module:<40}{seconds * 1000:>8.1f} ms")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    failed = False
+    if args.max_import_ms is not None and summary['import_s']['median'] * 1000 > args.max_import_ms:
+        print(f"\nimport time above {args.max_import_ms} ms")
+        failed = True
+    if args.max_first_request_ms is not None and summary['first_request_s']['median'] * 1000 > args.max_first_request_ms:
+        print(f"\nfirst request above {args.max_first_request_ms} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
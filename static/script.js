@@ -6,6 +6,8 @@ document.addEventListener('DOMContentLoaded', function () {
     const featureItems = document.querySelectorAll('.feature-item');
 
     let currentFeature = 'legal-consult';
+    // Server-side conversation; assigned by the first response
+    let sessionId = null;
 
     const initialTimestamp = document.querySelector('.message.system .timestamp');
     if (initialTimestamp) {
@@ -48,6 +50,12 @@ document.addEventListener('DOMContentLoaded', function () {
                     }
                     break;
 
+                case 'document-question':
+                    instructionText = "You've selected Ask About a Document. Ask a question about a document you analyzed in this conversation (e.g., 'What is the termination notice period?'), and I'll answer from its most relevant clauses.";
+                    uploadButton.style.display = 'none';
+                    userInput.placeholder = "Ask a question about your document...";
+                    break;
+
                 case 'legal-templates':
                     instructionText = "You've selected Legal Document Templates. Type the kind of document template you need (e.g., 'Non-disclosure Agreement', 'Employment Contract', 'Will'), and I'll generate a customizable template you can download.";
                     uploadButton.style.display = 'none';
@@ -103,28 +111,27 @@ document.addEventListener('DOMContentLoaded', function () {
                 const formData = new FormData();
                 formData.append('file', file);
 
+                formData.append('stream', 'true');
+                if (sessionId) {
+                    formData.append('sessionId', sessionId);
+                }
+
                 try {
                     const response = await fetch('/api/document-upload', {
                         method: 'POST',
                         body: formData
                     });
 
-                    await new Promise(resolve => setTimeout(resolve, 1500));
-
-                    removeTypingIndicator();
-
                     if (!response.ok) {
                         throw new Error('Error in document upload');
                     }
 
-                    const data = await response.json();
-
                     const processingMessage = document.querySelector('.message.system:nth-last-child(2)');
                     if (processingMessage) {
                         processingMessage.remove();
                     }
 
-                    addSystemMessage(data.response);
+                    await renderStreamedResponse(response);
 
                     fileInput.value = '';
 
@@ -169,6 +176,29 @@ document.addEventListener('DOMContentLoaded', function () {
             const thinkingTime = 1000 + Math.random() * 2000;
 
             try {
+                // Consultations and analyses are streamed; templates are only downloaded
+                if (currentFeature !== 'legal-templates') {
+                    const streamResponse = await fetch('/api/chat', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                        },
+                        body: JSON.stringify({
+                            message: message,
+                            feature: currentFeature,
+                            sessionId: sessionId,
+                            stream: true
+                        })
+                    });
+
+                    if (!streamResponse.ok) {
+                        throw new Error('Error in server response');
+                    }
+
+                    await renderStreamedResponse(streamResponse);
+                    return;
+                }
+
                 const response = await fetch('/api/chat', {
                     method: 'POST',
                     headers: {
@@ -267,6 +297,82 @@ document.addEventListener('DOMContentLoaded', function () {
         scrollToBottom();
     }
 
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+
+                if (data) {
+                    onEvent(eventName, JSON.parse(data));
+                }
+            }
+        }
+    }
+
+    async function renderStreamedResponse(response) {
+        // Validation errors and unsupported files still come back as plain JSON
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!contentType.includes('text/event-stream')) {
+            const data = await response.json();
+            removeTypingIndicator();
+            if (data.sessionId) {
+                sessionId = data.sessionId;
+            }
+            addSystemMessage(data.response || data.error);
+            return;
+        }
+
+        let text = '';
+        let messageBody = null;
+
+        await readEventStream(response, (eventName, data) => {
+            if (eventName === 'progress') {
+                if (data.message) {
+                    setTypingStatus(data.message);
+                }
+            } else if (eventName === 'token') {
+                if (!messageBody) {
+                    removeTypingIndicator();
+                    messageBody = addSystemMessage('');
+                }
+                text += data.text;
+                messageBody.innerHTML = marked.parse(text);
+                scrollToBottom();
+            } else if (eventName === 'done') {
+                if (data.sessionId) {
+                    sessionId = data.sessionId;
+                }
+            } else if (eventName === 'error') {
+                removeTypingIndicator();
+                addSystemMessage(data.response);
+            }
+        });
+
+        removeTypingIndicator();
+    }
+
     function addSystemMessage(content) {
         const now = new Date();
         const timeString = formatDate(now);
@@ -286,6 +392,8 @@ document.addEventListener('DOMContentLoaded', function () {
         `;
         chatMessages.insertAdjacentHTML('beforeend', messageHTML);
         scrollToBottom();
+
+        return chatMessages.lastElementChild.querySelector('.message-content > div');
     }
 
     function showTypingIndicator() {
@@ -308,6 +416,21 @@ document.addEventListener('DOMContentLoaded', function () {
         scrollToBottom();
     }
 
+    function setTypingStatus(text) {
+        const typingIndicator = document.getElementById('typing-indicator');
+        if (!typingIndicator) {
+            return;
+        }
+
+        let status = typingIndicator.querySelector('.typing-status');
+        if (!status) {
+            status = document.createElement('p');
+            status.className = 'typing-status';
+            typingIndicator.querySelector('.message-content').appendChild(status);
+        }
+        status.textContent = text;
+    }
+
     function removeTypingIndicator() {
         const typingIndicator = document.getElementById('typing-indicator');
         if (typingIndicator) {
@@ -0,0 +1,16 @@
+import time
+
+import pytest
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def wait_until():
+    """Poll condition() until it holds, failing the test after timeout seconds"""
+    return _wait_until
@@ -0,0 +1,85 @@
+from utils.chunking import count_tokens, iter_anchored_chunks, iter_chunks, iter_clauses
+
+
+def lease(articles=8, clauses=7):
+    return '\n'.join(
+        f"ARTICLE {n} - TERMS\n" + '\n'.join(
+            f"The Tenant shall pay rent instalment {i} of article {n} on time and keep the premises clean."
+            for i in range(1, clauses + 1))
+        for n in range(1, articles + 1))
+
+
+def clauses(count=60):
+    return [f"The Tenant shall pay rent instalment {i} on time and keep the premises clean." for i in range(count)]
+
+
+def test_chunks_never_exceed_the_token_cap():
+    long_paragraph = ' '.join(clauses(40))  # one line, many times the budget
+    long_word = 'x' * 2000  # no sentence or word boundary at all
+    text = '\n'.join([lease(), long_paragraph, long_word])
+
+    chunks = list(iter_chunks([text], 120))
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 120 for chunk in chunks)
+    assert ''.join(chunks).replace(' ', '').replace('\n', '') == text.replace(' ', '').replace('\n', '')
+
+
+def test_chunks_are_cut_where_an_article_begins():
+    chunks = list(iter_chunks([lease()], 200))
+
+    assert [chunk.split('\n')[0] for chunk in chunks] == [f"ARTICLE {n} - TERMS" for n in range(1, 9)]
+    assert ''.join(chunks) == lease() + '\n'
+
+
+def test_pages_are_chunked_like_the_whole_text():
+    text = lease()
+    lines = text.split('\n')
+    pages = ['\n'.join(lines[:20]), '\n'.join(lines[20:41]), '\n'.join(lines[41:])]
+
+    assert list(iter_chunks(pages, 200)) == list(iter_chunks([text], 200))
+
+
+def test_overlap_repeats_the_end_of_the_previous_chunk():
+    chunks = list(iter_chunks(['\n'.join(clauses())], 200, overlap_tokens=40))
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        first_line = chunk.split('\n')[0]
+        assert previous.endswith(first_line + '\n')
+        assert count_tokens(chunk) <= 200
+    assert clauses()[-1] in chunks[-1]
+
+
+def test_anchored_chunks_survive_an_insert():
+    lines = clauses()
+    previous = list(iter_chunks(['\n'.join(lines)], 200))
+    revised = '\n'.join(lines[:3] + ["The Landlord shall repair the roof within thirty days."] + lines[3:])
+
+    # Plain re-chunking shifts every boundary after the insert
+    assert not set(iter_chunks([revised], 200)) & set(previous)
+
+    anchored = list(iter_anchored_chunks([revised], previous, 200))
+    assert ''.join(anchored) == revised + '\n'
+    assert all(count_tokens(chunk) <= 200 for chunk in anchored)
+    assert previous[1:] == [chunk for chunk in anchored if chunk in previous]
+
+
+def test_anchored_chunks_only_change_around_an_edit():
+    previous = list(iter_chunks([lease()], 200))
+    revised = lease().replace('instalment 3 of article 5', 'instalment three of article 5')
+
+    anchored = list(iter_anchored_chunks([revised], previous, 200))
+
+    assert ''.join(anchored) == revised + '\n'
+    changed = [chunk for chunk in anchored if chunk not in previous]
+    assert len(changed) == 1 and 'instalment three of article 5' in changed[0]
+    assert len(anchored) == len(previous)
+
+
+def test_clauses_from_overlapping_chunks_are_not_repeated():
+    chunks = list(iter_chunks([lease()], 200, overlap_tokens=40))
+
+    found = list(iter_clauses(chunks, max_tokens=300, min_tokens=20))
+
+    assert len(found) == len(set(found))
+    assert found[0].startswith('ARTICLE 1 - TERMS')
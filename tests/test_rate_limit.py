@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.rate_limit import RateLimiter, RateLimitExceeded, TokenBucket
+
+
+def empty_limiter(rate=10, max_waiting=64):
+    bucket = TokenBucket(rate=rate, burst=1)
+    assert bucket.take() == 0  # the only token: everyone after this has to queue
+    return RateLimiter(bucket, max_waiting=max_waiting)
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    wait = bucket.take()
+    assert 0 < wait <= 0.1
+
+
+def test_interactive_callers_are_served_before_bulk(wait_until):
+    limiter = empty_limiter()
+    served = []
+
+    def call(name, priority):
+        limiter.acquire(priority)
+        served.append(name)
+
+    threads = []
+    for name, priority in [('bulk-1', 'bulk'), ('bulk-2', 'bulk'), ('bulk-3', 'bulk'), ('interactive', 'interactive')]:
+        thread = threading.Thread(target=call, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: len(limiter._waiting) + len(served) == len(threads))
+    for thread in threads:
+        thread.join(5)
+
+    assert served == ['interactive', 'bulk-1', 'bulk-2', 'bulk-3']
+    assert limiter.get_stats()['acquired'] == 4
+
+
+def test_async_callers_share_the_priority_queue():
+    limiter = empty_limiter()
+    served = []
+
+    async def call(name, priority):
+        await limiter.acquire_async(priority)
+        served.append(name)
+
+    async def main():
+        tasks = []
+        for name, priority in [('bulk-1', 'bulk'), ('bulk-2', 'bulk'), ('interactive', 'interactive')]:
+            tasks.append(asyncio.create_task(call(name, priority)))
+            while len(limiter._waiting) + len(served) < len(tasks):
+                await asyncio.sleep(0.001)
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    asyncio.run(main())
+    assert served == ['interactive', 'bulk-1', 'bulk-2']
+
+
+def test_admission_only_counts_callers_ahead():
+    limiter = empty_limiter(max_waiting=2)
+    with limiter.queued('bulk'), limiter.queued('bulk'):
+        with pytest.raises(RateLimitExceeded) as error:
+            limiter.admit('bulk')
+        assert error.value.retry_after >= 1
+        # Bulk work does not queue ahead of interactive requests
+        limiter.admit('interactive')
+    limiter.admit('bulk')
+
+    stats = limiter.get_stats()
+    assert stats['rejected'] == 1 and stats['admitted'] == 2
+    assert stats['queued_bulk'] == 0
+
+
+class SlowBucket(TokenBucket):
+    """Bucket whose take() blocks, like a shared bucket waiting on the SQLite lock"""
+
+    def __init__(self):
+        super().__init__(rate=100, burst=10)
+        self.taking = threading.Event()
+
+    def take(self):
+        self.taking.set()
+        time.sleep(0.3)
+        return super().take()
+
+
+def test_admission_is_not_blocked_by_a_slow_bucket():
+    limiter = RateLimiter(SlowBucket())
+    thread = threading.Thread(target=limiter.acquire)
+    thread.start()
+    limiter.bucket.taking.wait(5)
+
+    started = time.perf_counter()
+    limiter.admit('bulk')
+    with limiter.queued('bulk'):
+        pass
+    assert time.perf_counter() - started < 0.1
+    thread.join(5)
+
+
+def test_async_acquire_does_not_block_the_event_loop():
+    limiter = RateLimiter(SlowBucket())
+    ticks = []
+
+    async def ticker():
+        while len(ticks) < 10:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(ticker(), limiter.acquire_async())
+
+    asyncio.run(main())
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
@@ -0,0 +1,49 @@
+from utils.semantic_cache import SemanticCache, bigrams, embed, same_order
+
+
+def similarity(first, second):
+    first, second = embed(first), embed(second)
+    return sum(weight * second.get(feature, 0.0) for feature, weight in first.items())
+
+
+def test_rephrased_question_is_a_hit():
+    cache = SemanticCache(threshold=0.9)
+    cache.set('how do I terminate my lease early', 'answer')
+    assert cache.get('terminating a lease early') == 'answer'
+
+
+def test_role_reversed_question_is_a_miss():
+    # Same content words, so the vectors alone would call this a hit
+    assert similarity('Can I sue my landlord', 'Can my landlord sue me') >= 0.9
+    assert not same_order(bigrams('Can I sue my landlord'), bigrams('Can my landlord sue me'))
+
+    cache = SemanticCache(threshold=0.9)
+    cache.set('Can I sue my landlord', 'tenant suing')
+    assert cache.get('Can my landlord sue me') is None
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_role_reversed_questions_keep_their_own_answers():
+    cache = SemanticCache(threshold=0.9)
+    cache.set('Can I sue my landlord', 'tenant suing')
+    cache.set('Can my landlord sue me', 'landlord suing')
+    assert cache.get('Can I sue my landlord?') == 'tenant suing'
+    assert cache.get('can my landlord sue me?') == 'landlord suing'
+    assert cache.get_stats()['entries'] == 2
+
+
+def test_different_verb_is_not_a_hit():
+    # Shares "lease early" but the vectors are too far apart to trust as a paraphrase
+    assert same_order(bigrams('breaking a lease early'), bigrams('terminate a lease early'))
+    assert similarity('breaking a lease early', 'terminate a lease early') < 0.9
+
+    cache = SemanticCache(threshold=0.9)
+    cache.set('breaking a lease early', 'answer')
+    assert cache.get('terminate a lease early') is None
+
+
+def test_single_word_questions_skip_the_order_check():
+    assert same_order(bigrams('eviction'), bigrams('eviction notice'))
+    cache = SemanticCache(threshold=0.9)
+    cache.set('Eviction?', 'answer')
+    assert cache.get('eviction') == 'answer'
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result(wait_until):
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'answer'
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(flights.do, 'key', fn) for _ in range(5)]
+        wait_until(lambda: flights.get_stats()['shared'] == 4)
+        release.set()
+        results = [future.result(5) for future in futures]
+
+    assert results == ['answer'] * 5
+    assert len(calls) == 1
+    assert flights.get_stats()['in_flight'] == 0
+
+
+def test_waiters_get_the_exception_of_the_shared_call(wait_until):
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError('backend down')
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flights.do, 'key', fn) for _ in range(3)]
+        wait_until(lambda: flights.get_stats()['shared'] == 2)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(5)
+
+    # A failed call is not remembered: the next caller tries again
+    assert flights.do('key', lambda: 'recovered') == 'recovered'
+
+
+def test_different_keys_are_not_shared():
+    flights = SingleFlight()
+    assert flights.do('a', lambda: 1) == 1
+    assert flights.do('b', lambda: 2) == 2
+    assert flights.get_stats()['calls'] == 2
+    assert flights.get_stats()['shared'] == 0
+
+
+def test_async_tasks_share_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async('key', fn) for _ in range(4)))
+
+    assert asyncio.run(main()) == ['answer'] * 4
+    assert len(calls) == 1
+    assert flights.get_stats()['shared'] == 3
+
+
+def test_processes_share_results_through_the_database(tmp_path):
+    db_path = str(tmp_path / 'singleflight.sqlite3')
+    first, second = SingleFlight(db_path=db_path), SingleFlight(db_path=db_path)
+
+    assert first.do('key', lambda: {'text': 'answer'}) == {'text': 'answer'}
+    # The second instance (another worker) picks up the published result
+    assert second.do('key', lambda: pytest.fail('called twice')) == {'text': 'answer'}
+    assert second.get_stats()['process_shared'] == 1
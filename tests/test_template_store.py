@@ -0,0 +1,27 @@
+from utils.template_store import TemplateStore
+
+
+def test_templates_are_shared_through_the_database(tmp_path):
+    db_path = str(tmp_path / 'templates.sqlite3')
+    calls = []
+
+    def generate(document_type):
+        calls.append(document_type)
+        return f'{document_type} template'
+
+    assert TemplateStore(generate, db_path=db_path).prewarm(['NDA']) == ['Non-disclosure Agreement']
+
+    # Another process: served from the file, and not generated again by its own prewarm
+    serving = TemplateStore(generate, db_path=db_path)
+    assert serving.prewarm(['NDA']) == ['Non-disclosure Agreement']
+    assert serving.get('nda template') == 'Non-disclosure Agreement template'
+    assert calls == ['Non-disclosure Agreement']
+
+
+def test_lookup_counts_misses_without_generating():
+    store = TemplateStore(lambda document_type: document_type)
+    assert store.lookup('Lease') is None
+    store.put('lease', 'text')
+    assert store.lookup('LEASE template') == 'text'
+    stats = store.get_stats()
+    assert stats['misses'] == 1 and stats['hits'] == 1
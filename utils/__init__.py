@@ -0,0 +1 @@
+"""Helper modules used by the Legal Guardian Flask app."""
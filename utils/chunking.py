@@ -0,0 +1,270 @@
+"""Token-aware chunking that follows the structure of legal documents.
+
+Chunks are packed up to a token budget and preferably cut where a new
+article, section or numbered clause begins. Paragraphs that are larger than
+the budget on their own are split on sentences and, failing that, on words,
+so no chunk ever exceeds the hard cap. Tokens are counted with ``tiktoken``
+when it is installed and with a close regex approximation otherwise; the
+encoding is loaded on the first count rather than at import.
+"""
+import re
+
+_encoding = None
+_encoding_loaded = False
+
+# Word pieces of up to four characters, or single punctuation marks: close to
+# what BPE tokenizers produce for English and Spanish legal prose
+_APPROX_TOKEN = re.compile(r'\w{1,4}|[^\w\s]')
+
+_SECTION_KEYWORD = re.compile(
+    r'^(?:article|section|clause|schedule|exhibit|annex|appendix|part|chapter|'
+    r'artículo|articulo|cláusula|clausula|sección|seccion|anexo|capítulo|capitulo)'
+    r'\s+(?:\d|[IVXLC]+\b|[A-Z]\b)',
+    re.IGNORECASE
+)
+_NUMBERED = re.compile(
+    r'^(?:§\s*\d'
+    r'|\d+(?:\.\d+)*[.)]\s+\S'
+    r'|\d+\.\d+(?:\.\d+)*\s+\S'
+    r'|[IVXLC]+[.)]\s+\S)'
+)
+_ALL_CAPS = re.compile(r'^[A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ0-9 ,&\-]{3,}$')
+
+_SENTENCE_END = re.compile(r'(?<=[.;:!?])\s+')
+
+# A chunk is only cut back to the last section boundary if at least this
+# fraction of the budget stays in the chunk being emitted
+MIN_FILL_RATIO = 0.5
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:  # tiktoken missing or its encoding files unavailable
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(_APPROX_TOKEN.findall(text))
+
+
+def is_heading(line):
+    """True if line starts a new article, section or numbered clause"""
+    stripped = line.strip()
+    if not stripped or len(stripped) > 200:
+        return False
+    return bool(_SECTION_KEYWORD.match(stripped)
+                or _NUMBERED.match(stripped)
+                or _ALL_CAPS.match(stripped))
+
+
+def _split_characters(text, tokens, max_tokens):
+    """Cut text into character windows of at most max_tokens tokens each"""
+    pieces = []
+    window = max(1, len(text) * max_tokens // tokens)
+    start = 0
+    while start < len(text):
+        size = window
+        part = text[start:start + size]
+        part_tokens = count_tokens(part)
+        while part_tokens > max_tokens and size > 1:
+            size = max(1, size * 3 // 4)
+            part = text[start:start + size]
+            part_tokens = count_tokens(part)
+        pieces.append((part, part_tokens))
+        start += size
+    return pieces
+
+
+def _split_oversized(text, max_tokens):
+    """Split a paragraph larger than max_tokens into sentence/word pieces"""
+    pieces = []
+    current, current_tokens = [], 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            pieces.append((''.join(current), current_tokens))
+        current, current_tokens = [], 0
+
+    for sentence in _SENTENCE_END.split(text):
+        sentence_tokens = count_tokens(sentence + ' ')
+        if sentence_tokens > max_tokens:
+            # No usable sentence boundary: fall back to words, and to raw
+            # character windows for "words" that are over budget themselves
+            for word in sentence.split(' '):
+                word_tokens = count_tokens(word + ' ')
+                if word_tokens > max_tokens:
+                    flush()
+                    pieces.extend(_split_characters(word + ' ', word_tokens, max_tokens))
+                    continue
+                if current and current_tokens + word_tokens > max_tokens:
+                    flush()
+                current.append(word + ' ')
+                current_tokens += word_tokens
+            continue
+        if current and current_tokens + sentence_tokens > max_tokens:
+            flush()
+        current.append(sentence + ' ')
+        current_tokens += sentence_tokens
+    flush()
+    return pieces
+
+
+def _iter_segments(pieces, max_tokens):
+    """Yield (text, tokens, starts_section) per line across all pieces"""
+    for piece in pieces:
+        for line in piece.split('\n'):
+            text = line + '\n'
+            tokens = count_tokens(text)
+            starts_section = is_heading(line)
+            if tokens <= max_tokens:
+                yield text, tokens, starts_section
+                continue
+            for i, (part, part_tokens) in enumerate(_split_oversized(line, max_tokens)):
+                yield part, part_tokens, starts_section and i == 0
+
+
+def iter_chunks(pieces, max_tokens, overlap_tokens=0):
+    """Yield chunks of at most max_tokens tokens from an iterable of text pieces.
+
+    Chunks are emitted as soon as they are complete, so pieces can be a lazy
+    page generator. The last overlap_tokens worth of lines of each chunk are
+    repeated at the start of the next one.
+    """
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    # Each entry: [text, tokens, starts_section, is_overlap]
+    current = []
+    current_tokens = 0
+
+    def emit():
+        nonlocal current, current_tokens
+        cut = len(current)
+        # Prefer to cut where the most recent section begins
+        running = 0
+        for i, (_, tokens, starts_section, is_overlap) in enumerate(current):
+            if i > 0 and starts_section and not is_overlap and running >= max_tokens * MIN_FILL_RATIO:
+                cut = i
+            running += tokens
+
+        head, carry = current[:cut], current[cut:]
+        chunk = None
+        if not all(entry[3] for entry in head):
+            chunk = ''.join(entry[0] for entry in head)
+
+        overlap = []
+        if chunk is not None and overlap_tokens:
+            taken = 0
+            for entry in reversed(head):
+                if taken + entry[1] > overlap_tokens:
+                    break
+                overlap.insert(0, [entry[0], entry[1], False, True])
+                taken += entry[1]
+
+        current = overlap + carry
+        current_tokens = sum(entry[1] for entry in current)
+        return chunk
+
+    for text, tokens, starts_section in _iter_segments(pieces, max_tokens):
+        while current and current_tokens + tokens > max_tokens:
+            # emit() returns None when only carried-over overlap was left
+            chunk = emit()
+            if chunk is not None:
+                yield chunk
+        current.append([text, tokens, starts_section, False])
+        current_tokens += tokens
+
+    if current and not all(entry[3] for entry in current):
+        yield ''.join(entry[0] for entry in current)
+
+
+def iter_anchored_chunks(pieces, previous_chunks, max_tokens, overlap_tokens=0):
+    """Re-chunk a revised document, reusing the chunks of its previous version.
+
+    Every previous chunk that still occurs verbatim (in order) is yielded
+    unchanged, so its cached analysis stays valid; only the text between these
+    anchors is chunked afresh. An edit therefore changes the chunks around it
+    instead of shifting every chunk boundary after it.
+    """
+    text = ''.join(segment for segment, _, _ in _iter_segments(pieces, max_tokens))
+    cursor = 0
+    search_from = 0
+
+    def gap(end):
+        # _iter_segments re-adds the newline after the last line
+        stretch = text[cursor:end]
+        if stretch.endswith('\n'):
+            stretch = stretch[:-1]
+        if stretch.strip():
+            yield from iter_chunks([stretch], max_tokens, overlap_tokens)
+
+    for previous in previous_chunks:
+        if not previous:
+            continue
+        position = text.find(previous, search_from)
+        if position < 0:
+            continue
+        if position > cursor:
+            yield from gap(position)
+        yield previous
+        # Chunks overlap when overlap_tokens is set, so the next one may start
+        # before this one ends
+        search_from = position + 1
+        cursor = max(cursor, position + len(previous))
+
+    if cursor < len(text):
+        yield from gap(len(text))
+
+
+def iter_clauses(chunks, max_tokens=300, min_tokens=20):
+    """Split analysis chunks into clauses for retrieval.
+
+    A clause starts at a heading (article, section, numbered clause) or at a
+    blank line once the current clause has min_tokens; it never exceeds
+    max_tokens. Lines repeated by chunk overlap are only yielded once.
+    """
+    seen = set()
+    current, current_tokens = [], 0
+
+    def flush():
+        nonlocal current, current_tokens
+        clause = ''.join(current).strip()
+        current, current_tokens = [], 0
+        if clause and clause not in seen:
+            seen.add(clause)
+            return clause
+        return None
+
+    for chunk in chunks:
+        for line in chunk.split('\n'):
+            if not line.strip() or is_heading(line):
+                if current_tokens >= min_tokens or (line.strip() and current_tokens):
+                    clause = flush()
+                    if clause is not None:
+                        yield clause
+                if not line.strip():
+                    continue
+
+            text = line + '\n'
+            tokens = count_tokens(text)
+            pieces = [(text, tokens)] if tokens <= max_tokens else _split_oversized(line, max_tokens)
+            for piece, piece_tokens in pieces:
+                if current and current_tokens + piece_tokens > max_tokens:
+                    clause = flush()
+                    if clause is not None:
+                        yield clause
+                current.append(piece)
+                current_tokens += piece_tokens
+
+        # A chunk boundary is a clause boundary too
+        clause = flush()
+        if clause is not None:
+            yield clause
@@ -0,0 +1,182 @@
+"""Clause-level search index over previously analyzed documents.
+
+The clauses of each document are stored in a SQLite FTS5 table (BM25 with
+Porter stemming) and, optionally, as the local sparse embeddings used by the
+consultation cache. A question is matched against both and the two rankings
+are merged with reciprocal rank fusion, so a targeted question about a long
+agreement only needs its few most relevant clauses sent to the LLM.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils.semantic_cache import STOPWORDS, embed
+
+# Rank offset of reciprocal rank fusion: 1 / (RRF_K + rank)
+RRF_K = 60
+
+# Documents whose decoded clause vectors are kept in memory between searches
+DECODED_DOCUMENTS = 64
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _match_expression(query):
+    """FTS5 query matching any non-stopword of query, or None"""
+    words = [w for w in _WORD.findall(query.lower()) if w not in STOPWORDS]
+    if not words:
+        return None
+    return ' OR '.join(f'"{word}"' for word in dict.fromkeys(words))
+
+
+class ClauseIndex:
+    """Clauses per document ID, searchable by full text and local embeddings"""
+
+    def __init__(self, db_path=None, embeddings=True, max_documents=1000):
+        self.embeddings = embeddings
+        self.max_documents = max_documents
+        self._lock = threading.Lock()
+        self._vectors = OrderedDict()  # document_id -> [(position, {feature: weight})]
+        self._db = sqlite3.connect(db_path or ':memory:', check_same_thread=False)
+        self.stats = {'searches': 0, 'empty_searches': 0, 'evictions': 0}
+
+        self._db.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS clause_text USING fts5('
+            'document_id UNINDEXED, position UNINDEXED, text, '
+            "tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS clause_vectors ('
+            'document_id TEXT NOT NULL, position INTEGER NOT NULL, vector TEXT NOT NULL, '
+            'PRIMARY KEY (document_id, position))'
+        )
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS clause_documents ('
+            'document_id TEXT PRIMARY KEY, clauses INTEGER NOT NULL, updated REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def _delete(self, document_id):
+        self._vectors.pop(document_id, None)
+        self._db.execute('DELETE FROM clause_text WHERE document_id = ?', (document_id,))
+        self._db.execute('DELETE FROM clause_vectors WHERE document_id = ?', (document_id,))
+        self._db.execute('DELETE FROM clause_documents WHERE document_id = ?', (document_id,))
+
+    def put(self, document_id, clauses):
+        """Replace the clauses indexed for document_id"""
+        vectors = [json.dumps(embed(clause)) for clause in clauses] if self.embeddings else None
+        with self._lock:
+            self._delete(document_id)
+            self._db.executemany(
+                'INSERT INTO clause_text (document_id, position, text) VALUES (?, ?, ?)',
+                [(document_id, i, clause) for i, clause in enumerate(clauses)]
+            )
+            if vectors is not None:
+                self._db.executemany(
+                    'INSERT INTO clause_vectors (document_id, position, vector) VALUES (?, ?, ?)',
+                    [(document_id, i, vector) for i, vector in enumerate(vectors)]
+                )
+            self._db.execute(
+                'INSERT INTO clause_documents (document_id, clauses, updated) VALUES (?, ?, ?)',
+                (document_id, len(clauses), time.time())
+            )
+
+            # Least recently indexed documents go first
+            overflow = self._db.execute(
+                'SELECT document_id FROM clause_documents ORDER BY updated DESC LIMIT -1 OFFSET ?',
+                (self.max_documents,)
+            ).fetchall()
+            for (stale_id,) in overflow:
+                self._delete(stale_id)
+            self.stats['evictions'] += len(overflow)
+            self._db.commit()
+
+    def has(self, document_id):
+        with self._lock:
+            return self._db.execute(
+                'SELECT 1 FROM clause_documents WHERE document_id = ?', (document_id,)
+            ).fetchone() is not None
+
+    def _text_ranking(self, document_ids, query, limit):
+        expression = _match_expression(query)
+        if expression is None:
+            return []
+        marks = ','.join('?' * len(document_ids))
+        rows = self._db.execute(
+            f'SELECT document_id, position FROM clause_text '
+            f'WHERE clause_text MATCH ? AND document_id IN ({marks}) '
+            f'ORDER BY bm25(clause_text) LIMIT ?',
+            (expression, *document_ids, limit)
+        ).fetchall()
+        return [(document_id, int(position)) for document_id, position in rows]
+
+    def _document_vectors(self, document_id):
+        """Decoded clause vectors of a document, kept for the next searches"""
+        vectors = self._vectors.get(document_id)
+        if vectors is None:
+            vectors = [
+                (position, {int(feature): weight for feature, weight in json.loads(vector).items()})
+                for position, vector in self._db.execute(
+                    'SELECT position, vector FROM clause_vectors WHERE document_id = ?', (document_id,))
+            ]
+            self._vectors[document_id] = vectors
+            while len(self._vectors) > DECODED_DOCUMENTS:
+                self._vectors.popitem(last=False)
+        self._vectors.move_to_end(document_id)
+        return vectors
+
+    def _vector_ranking(self, document_ids, query, limit):
+        query_vector = embed(query)
+        if not query_vector:
+            return []
+        scored = []
+        for document_id in document_ids:
+            for position, clause_vector in self._document_vectors(document_id):
+                # Both vectors are unit length, so the dot product is the cosine
+                score = sum(weight * clause_vector.get(feature, 0.0) for feature, weight in query_vector.items())
+                if score > 0:
+                    scored.append((score, document_id, position))
+        scored.sort(reverse=True)
+        return [(document_id, position) for _, document_id, position in scored[:limit]]
+
+    def search(self, document_ids, query, k=6):
+        """Top k clauses of document_ids for query, as dicts with document_id, position, text and score"""
+        document_ids = list(document_ids)
+        if not document_ids:
+            return []
+        with self._lock:
+            self.stats['searches'] += 1
+            scores = {}
+            rankings = [self._text_ranking(document_ids, query, k * 4)]
+            if self.embeddings:
+                rankings.append(self._vector_ranking(document_ids, query, k * 4))
+            for ranking in rankings:
+                for rank, clause in enumerate(ranking):
+                    scores[clause] = scores.get(clause, 0.0) + 1.0 / (RRF_K + rank + 1)
+            if not scores:
+                self.stats['empty_searches'] += 1
+                return []
+
+            best = sorted(scores, key=scores.get, reverse=True)[:k]
+            results = []
+            for document_id, position in best:
+                row = self._db.execute(
+                    'SELECT text FROM clause_text WHERE document_id = ? AND position = ?',
+                    (document_id, position)
+                ).fetchone()
+                if row is not None:
+                    results.append({'document_id': document_id, 'position': position,
+                                    'text': row[0], 'score': round(scores[(document_id, position)], 6)})
+            return results
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['documents'], clauses = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(clauses), 0) FROM clause_documents'
+            ).fetchone()
+            stats['clauses'] = clauses
+        return stats
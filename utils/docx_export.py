@@ -0,0 +1,131 @@
+"""Markdown templates to Word documents, built entirely in memory.
+
+The package of a blank python-docx document (styles, numbering, theme...) is
+built and compressed once per process. Each export copies that skeleton,
+writes a fresh word/document.xml into it and returns the bytes, so no
+temporary files are involved and python-docx is not re-opened per request.
+
+Headings, (nested) bullet lists, numbered items and **bold** / *italic* runs
+are mapped to Word styles in a single pass over the lines. Numbered items
+keep the number written in the template, since Word's automatic numbering
+would renumber clauses across separate lists.
+"""
+import io
+import re
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+DOCUMENT_PART = 'word/document.xml'
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+_BULLET = re.compile(r'^(\s*)[-*+]\s+(.*)$')
+_NUMBERED = re.compile(r'^\s*(\d+[.)])\s+(.*)$')
+_RULE = re.compile(r'^\s*(?:-{3,}|\*{3,}|_{3,})\s*$')
+# **bold**, __bold__, *italic*, _italic_
+_INLINE = re.compile(r'(\*\*.+?\*\*|__.+?__|\*[^*\s][^*]*?\*|(?<!\w)_[^_\s][^_]*?_(?!\w))')
+# Control characters that are not allowed in XML 1.0
+_INVALID_XML = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_skeleton = None
+_skeleton_lock = threading.Lock()
+
+
+class _Skeleton:
+    """Compressed package parts of a blank document, minus its body"""
+
+    def __init__(self):
+        from docx import Document
+
+        doc = Document()
+        styles = doc.styles
+        self.headings = {level: styles[f'Heading {level}'].style_id for level in range(1, 7)}
+        self.bullets = {depth: styles[name].style_id
+                        for depth, name in ((1, 'List Bullet'), (2, 'List Bullet 2'), (3, 'List Bullet 3'))}
+        self.numbered = styles['List Paragraph'].style_id
+
+        saved = io.BytesIO()
+        doc.save(saved)
+        package = io.BytesIO()
+        with zipfile.ZipFile(saved) as source, \
+                zipfile.ZipFile(package, 'w', zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                if info.filename == DOCUMENT_PART:
+                    document_xml = source.read(info).decode('utf-8')
+                else:
+                    target.writestr(info.filename, source.read(info))
+        self.package = package.getvalue()
+
+        # Paragraphs go between <w:body> and the section properties
+        split_at = document_xml.index('<w:sectPr')
+        self.head, self.tail = document_xml[:split_at], document_xml[split_at:]
+
+
+def _get_skeleton():
+    global _skeleton
+    if _skeleton is None:
+        with _skeleton_lock:
+            if _skeleton is None:
+                _skeleton = _Skeleton()
+    return _skeleton
+
+
+def _run(text, emphasis=''):
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    properties = f'<w:rPr>{emphasis}</w:rPr>' if emphasis else ''
+    return f'<w:r>{properties}<w:t{space}>{escape(_INVALID_XML.sub("", text))}</w:t></w:r>'
+
+
+def _runs(text):
+    parts = []
+    for part in _INLINE.split(text):
+        if not part:
+            continue
+        if part.startswith(('**', '__')) and part.endswith(('**', '__')) and len(part) > 4:
+            parts.append(_run(part[2:-2], '<w:b/>'))
+        elif part[0] in '*_' and part[-1] == part[0] and len(part) > 2:
+            parts.append(_run(part[1:-1], '<w:i/>'))
+        else:
+            parts.append(_run(part))
+    return ''.join(parts)
+
+
+def _paragraph(text, style=None):
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}{_runs(text)}</w:p>'
+
+
+def build_docx(markdown_text):
+    """Word document for markdown_text, returned as a BytesIO positioned at 0"""
+    skeleton = _get_skeleton()
+    paragraphs = []
+
+    for line in markdown_text.split('\n'):
+        stripped = line.strip()
+        if not stripped or _RULE.match(stripped):
+            continue
+
+        match = _HEADING.match(stripped)
+        if match:
+            level = len(match.group(1))
+            paragraphs.append(_paragraph(match.group(2).strip().strip('#').strip(), skeleton.headings[level]))
+            continue
+
+        match = _BULLET.match(line)
+        if match:
+            depth = min(3, 1 + len(match.group(1).expandtabs(4)) // 2)
+            paragraphs.append(_paragraph(match.group(2), skeleton.bullets[depth]))
+            continue
+
+        match = _NUMBERED.match(line)
+        if match:
+            paragraphs.append(_paragraph(f"{match.group(1)} {match.group(2)}", skeleton.numbered))
+            continue
+
+        paragraphs.append(_paragraph(stripped))
+
+    buffer = io.BytesIO(skeleton.package)
+    with zipfile.ZipFile(buffer, 'a', zipfile.ZIP_DEFLATED) as package:
+        package.writestr(DOCUMENT_PART, skeleton.head + ''.join(paragraphs) + skeleton.tail)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,179 @@
+"""Upload buffering, archive reading and PDF text extraction.
+
+Uploads are kept in memory and only spilled to a uniquely named temporary
+file when they are large. Page extraction in PyPDF2 is CPU-bound pure Python,
+so PDFs with many pages are split into page ranges that separate processes
+extract in parallel. Pages can be consumed as a generator, in page order,
+while later ranges are still running. PyPDF2 is imported on the first PDF.
+"""
+import io
+import multiprocessing
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+PDF_EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 16))
+# Below this many pages the process pool costs more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 32))
+
+# Uploads larger than this are spilled to a temporary file instead of memory
+UPLOAD_MAX_MEMORY_BYTES = int(os.getenv('UPLOAD_MAX_MEMORY_BYTES', 10 * 1024 * 1024))
+UPLOAD_SPILL_DIR = os.getenv('UPLOAD_SPILL_DIR') or None
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # Forking the threaded server could copy a lock held by another thread
+        # into the child; forkserver children start from a clean process
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS,
+                                    mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def _extract_page_range(path, start, end):
+    """Worker: extract pages [start, end) of the PDF at path"""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(path)
+    return [(reader.pages[i].extract_text() or '') for i in range(start, end)]
+
+
+class UploadBuffer:
+    """Contents of an uploaded file, in memory or spilled to a unique temp file"""
+
+    def __init__(self, stream, filename, max_memory=UPLOAD_MAX_MEMORY_BYTES):
+        self.filename = filename
+        self.path = None
+        self._data = None
+
+        head = stream.read(max_memory + 1)
+        if len(head) <= max_memory:
+            self._data = head
+            return
+
+        extension = os.path.splitext(filename)[1].lower()
+        fd, self.path = tempfile.mkstemp(prefix='upload-', suffix=extension, dir=UPLOAD_SPILL_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head)
+            shutil.copyfileobj(stream, f)
+
+    @property
+    def source(self):
+        """A path (when spilled) or a fresh in-memory file object"""
+        if self.path is not None:
+            return self.path
+        return io.BytesIO(self._data)
+
+    def close(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class ArchiveReader:
+    """Files inside a .zip or .tar(.gz) upload, read one member at a time.
+
+    Members can be opened from several threads; reads of the underlying
+    archive are serialized.
+    """
+
+    def __init__(self, source, filename):
+        self._lock = threading.Lock()
+        if filename.lower().endswith('.zip'):
+            self._zip = zipfile.ZipFile(source)
+            self._tar = None
+            self.names = [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            self._zip = None
+            if isinstance(source, str):
+                self._tar = tarfile.open(source, 'r:*')
+            else:
+                self._tar = tarfile.open(fileobj=source, mode='r:*')
+            self.names = [member.name for member in self._tar.getmembers() if member.isfile()]
+        # Skip metadata that archivers add next to the real files
+        self.names = [name for name in self.names
+                      if not name.startswith('__MACOSX/') and not os.path.basename(name).startswith('.')]
+
+    def open(self, name):
+        """UploadBuffer with the contents of member name"""
+        with self._lock:
+            if self._zip is not None:
+                with self._zip.open(name) as member:
+                    return UploadBuffer(member, os.path.basename(name))
+            member = self._tar.extractfile(name)
+            try:
+                return UploadBuffer(member, os.path.basename(name))
+            finally:
+                member.close()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+
+def _spill(source):
+    """Write an in-memory PDF to a unique temp file the workers can open"""
+    source.seek(0)
+    fd, path = tempfile.mkstemp(prefix='upload-', suffix='.pdf', dir=UPLOAD_SPILL_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(source, f)
+    return path
+
+
+def iter_pdf_pages(source, workers=PDF_EXTRACT_WORKERS, pages_per_task=PDF_PAGES_PER_TASK):
+    """Yield the text of each page of a PDF (path or file object), in page order.
+
+    PDFs of PDF_PARALLEL_MIN_PAGES or more pages go to the process pool, however
+    small the file. Workers open the PDF by path: an in-memory one is written to
+    a temp file once rather than pickled to every task.
+    """
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(source)
+    page_count = len(reader.pages)
+
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ''
+        return
+
+    path = source if isinstance(source, str) else _spill(source)
+    pool = _get_pool()
+    futures = [
+        pool.submit(_extract_page_range, path, start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    ]
+    try:
+        # Ranges are awaited in order so early pages stream out first
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if path is not source:
+            # Nobody reads the ranges still running any more
+            os.remove(path)
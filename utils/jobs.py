@@ -0,0 +1,141 @@
+"""Background job queue for long-running document analyses.
+
+Jobs are recorded in a SQLite file and executed by a local thread pool, so an
+upload request can return a job ID immediately. Every unfinished job is owned
+by one process under a lease that the owner keeps renewing. ``resume()`` picks
+up only jobs whose lease ran out (their process stopped), so several worker
+processes can share the file without running a job twice.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    """Persisted job store plus a local worker pool"""
+
+    def __init__(self, handler, db_path='jobs.sqlite3', max_workers=2, lease=60):
+        self._handler = handler
+        self.lease = lease
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, '
+            'done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, '
+            'payload TEXT NOT NULL, result TEXT, error TEXT, '
+            'created REAL NOT NULL, updated REAL NOT NULL, '
+            'owner TEXT, lease_expires REAL NOT NULL DEFAULT 0)'
+        )
+        # Job files written before leases existed
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        if 'owner' not in columns:
+            self._db.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            self._db.execute('ALTER TABLE jobs ADD COLUMN lease_expires REAL NOT NULL DEFAULT 0')
+        self._db.commit()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._heartbeat = None
+
+    def _update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._lock:
+            self._db.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+            self._db.commit()
+
+    def _run(self, job_id, payload):
+        self._update(job_id, status=RUNNING, stage='starting')
+
+        def report(stage, done=0, total=0):
+            self._update(job_id, stage=stage, done=done, total=total)
+
+        try:
+            result = self._handler(payload, report)
+            self._update(job_id, status=DONE, stage='done', result=result)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed: {str(e)}")
+            self._update(job_id, status=FAILED, stage='failed', error=str(e))
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._lock:
+                    self._db.execute(
+                        'UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status IN (?, ?)',
+                        (time.time() + self.lease, self.owner, QUEUED, RUNNING)
+                    )
+                    self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not renew job leases: {str(e)}")
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._heartbeat = threading.Thread(target=self._renew_leases, name='job-leases', daemon=True)
+        self._heartbeat.start()
+
+    def submit(self, payload):
+        """Persist a new job, owned by this process, and queue it. Returns the job ID."""
+        self._start_heartbeat()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO jobs (id, status, stage, payload, created, updated, owner, lease_expires) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, QUEUED, 'queued', json.dumps(payload), now, now, self.owner, now + self.lease)
+            )
+            self._db.commit()
+        self._executor.submit(self._run, job_id, payload)
+        return job_id
+
+    def resume(self):
+        """Take over and re-queue unfinished jobs whose owner's lease has expired"""
+        self._start_heartbeat()
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, payload FROM jobs WHERE status IN (?, ?) AND lease_expires < ? ORDER BY created',
+                (QUEUED, RUNNING, now)
+            ).fetchall()
+        resumed = 0
+        for job_id, payload in rows:
+            with self._lock:
+                # Conditional update: only one process wins the job if several resume at once
+                claimed = self._db.execute(
+                    'UPDATE jobs SET owner = ?, lease_expires = ?, status = ?, stage = ?, done = 0, total = 0, '
+                    'updated = ? WHERE id = ? AND status IN (?, ?) AND lease_expires < ?',
+                    (self.owner, now + self.lease, QUEUED, 'queued', now, job_id, QUEUED, RUNNING, now)
+                ).rowcount
+                self._db.commit()
+            if claimed:
+                self._executor.submit(self._run, job_id, json.loads(payload))
+                resumed += 1
+        return resumed
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if it does not exist"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, status, stage, done, total, result, error, created, updated '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'status', 'stage', 'done', 'total', 'result', 'error', 'created', 'updated')
+        return dict(zip(keys, row))
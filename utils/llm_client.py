@@ -0,0 +1,347 @@
+"""Shared HTTP client for the Cohere chat API.
+
+A single ``requests.Session`` keeps TCP/TLS connections alive between calls,
+and failed calls (429/5xx, timeouts, dropped connections) are retried with
+jittered exponential backoff that honours ``Retry-After``. ``requests`` is
+only imported when the first call is made, to keep process startup fast.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+COHERE_CHAT_URL = 'https://api.cohere.ai/v2/chat'
+DEFAULT_MODEL = 'command-r'
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when the chat API does not return a usable response"""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+def _retry_after_seconds(response):
+    """Parse a Retry-After header (delta-seconds or HTTP date)"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMBackend:
+    """Interface the app uses to talk to a chat model"""
+
+    model = None
+
+    def chat(self, prompt, max_tokens=1024, temperature=0.1, timeout=None):
+        """Return the full response text for a single-turn prompt"""
+        raise NotImplementedError
+
+    def chat_stream(self, prompt, max_tokens=1024, temperature=0.1, timeout=None):
+        """Yield the response text for a single-turn prompt as it is generated"""
+        raise NotImplementedError
+
+
+class CohereClient(LLMBackend):
+    """Pooled, retrying client for the Cohere v2 chat endpoint.
+
+    Anything that speaks the same protocol (such as bench/mock_llm_server.py)
+    can be used by pointing ``url`` at it.
+    """
+
+    def __init__(self, api_key=None, url=COHERE_CHAT_URL, model=DEFAULT_MODEL,
+                 pool_size=10, timeout=30, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0):
+        self._api_key = api_key
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Pooled requests.Session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    @property
+    def api_key(self):
+        return self._api_key or os.getenv('COHERE_API_KEY')
+
+    def _headers(self):
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to wait before retry number ``attempt`` (0-based)"""
+        if response is not None:
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        # Full jitter: uniform in [0, base * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def build_payload(self, prompt, max_tokens=1024, temperature=0.1):
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens
+        }
+        if temperature is not None:
+            payload["temperature"] = temperature
+        return payload
+
+    def post(self, payload, timeout=None, stream=False):
+        """POST a chat payload, retrying transient failures. Returns the response."""
+        import requests
+
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(
+                    self.url,
+                    headers=self._headers(),
+                    json=payload,
+                    timeout=timeout,
+                    stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"Request failed after {attempt + 1} attempts: {e}") from e
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                logger.warning(f"LLM call returned {response.status_code}, retrying in {delay:.2f}s")
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    @staticmethod
+    def parse_response(result):
+        return result['message']['content'][0]['text']
+
+    @staticmethod
+    def parse_stream_line(line):
+        """Parse one server-sent event line. Returns (text or None, finished)."""
+        # Only the "data:" lines carry the JSON payload
+        if not line or not line.startswith('data:'):
+            return None, False
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return None, True
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return None, False
+        event_type = event.get('type')
+        if event_type == 'content-delta':
+            text = event.get('delta', {}).get('message', {}).get('content', {}).get('text')
+            return text or None, False
+        return None, event_type == 'message-end'
+
+    def chat(self, prompt, max_tokens=1024, temperature=0.1, timeout=None):
+        """Send a single-turn chat request and return the response text"""
+        payload = self.build_payload(prompt, max_tokens=max_tokens, temperature=temperature)
+        response = self.post(payload, timeout=timeout)
+        if response.status_code != 200:
+            raise LLMError(
+                f"Error {response.status_code}: {response.text}",
+                status_code=response.status_code,
+                body=response.text
+            )
+        try:
+            return self.parse_response(response.json())
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMError(f"Unexpected response format: {e}", status_code=response.status_code,
+                           body=response.text) from e
+
+    def chat_stream(self, prompt, max_tokens=1024, temperature=0.1, timeout=None):
+        """Send a chat request with streaming enabled and yield text deltas.
+
+        Retries only happen before the first byte arrives; once text has been
+        yielded, a dropped stream raises LLMError.
+        """
+        import requests
+
+        payload = self.build_payload(prompt, max_tokens=max_tokens, temperature=temperature)
+        payload["stream"] = True
+        response = self.post(payload, timeout=timeout, stream=True)
+        if response.status_code != 200:
+            body = response.text
+            response.close()
+            raise LLMError(f"Error {response.status_code}: {body}",
+                           status_code=response.status_code, body=body)
+
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                text, finished = self.parse_stream_line(line)
+                if text:
+                    yield text
+                if finished:
+                    break
+        except requests.RequestException as e:
+            raise LLMError(f"Stream interrupted: {e}") from e
+        finally:
+            response.close()
+
+
+class AsyncCohereClient(CohereClient):
+    """Non-blocking variant of CohereClient for the ASGI serving mode.
+
+    Uses an httpx.AsyncClient (imported lazily, only this mode needs httpx)
+    with the same payloads, retry policy and response parsing.
+    """
+
+    def __init__(self, api_key=None, url=COHERE_CHAT_URL, model=DEFAULT_MODEL,
+                 pool_size=100, timeout=30, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0):
+        self._api_key = api_key
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.pool_size,
+                                    max_keepalive_connections=self.pool_size)
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _send(self, payload, timeout=None, stream=False):
+        """POST a chat payload, retrying transient failures. Returns the response."""
+        import httpx
+        client = self._get_client()
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            try:
+                request = client.build_request('POST', self.url, headers=self._headers(),
+                                               json=payload, timeout=timeout)
+                response = await client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError) as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"Request failed after {attempt + 1} attempts: {e}") from e
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                logger.warning(f"LLM call returned {response.status_code}, retrying in {delay:.2f}s")
+                await response.aclose()
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            return response
+
+    async def chat(self, prompt, max_tokens=1024, temperature=0.1, timeout=None):
+        """Send a single-turn chat request and return the response text"""
+        payload = self.build_payload(prompt, max_tokens=max_tokens, temperature=temperature)
+        response = await self._send(payload, timeout=timeout)
+        if response.status_code != 200:
+            raise LLMError(f"Error {response.status_code}: {response.text}",
+                           status_code=response.status_code, body=response.text)
+        try:
+            return self.parse_response(response.json())
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMError(f"Unexpected response format: {e}", status_code=response.status_code,
+                           body=response.text) from e
+
+    async def chat_stream(self, prompt, max_tokens=1024, temperature=0.1, timeout=None):
+        """Async generator of text deltas from the streaming chat endpoint"""
+        import httpx
+        payload = self.build_payload(prompt, max_tokens=max_tokens, temperature=temperature)
+        payload["stream"] = True
+        response = await self._send(payload, timeout=timeout, stream=True)
+        try:
+            if response.status_code != 200:
+                body = (await response.aread()).decode('utf-8', errors='replace')
+                raise LLMError(f"Error {response.status_code}: {body}",
+                               status_code=response.status_code, body=body)
+            async for line in response.aiter_lines():
+                text, finished = self.parse_stream_line(line)
+                if text:
+                    yield text
+                if finished:
+                    break
+        except httpx.HTTPError as e:
+            raise LLMError(f"Stream interrupted: {e}") from e
+        finally:
+            await response.aclose()
+
+
+# Backends selectable through LLM_BACKEND
+BACKENDS = {
+    'cohere': CohereClient,
+}
+
+# Non-blocking counterparts used by asgi.py
+ASYNC_BACKENDS = {
+    'cohere': AsyncCohereClient,
+}
+
+
+def create_backend(name='cohere', asynchronous=False, **kwargs):
+    """Instantiate the chat backend registered under name"""
+    registry = ASYNC_BACKENDS if asynchronous else BACKENDS
+    try:
+        backend_class = registry[name]
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend '{name}'. Available: {', '.join(registry)}")
+    return backend_class(**kwargs)
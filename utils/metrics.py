@@ -0,0 +1,133 @@
+"""Latency histograms and counters in the Prometheus text format.
+
+Pipeline stages are timed with ``span('stage_name')`` (or ``timed_iter`` for
+lazy generators such as page extraction) and exported by the /metrics route.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond cache hits up to multi-minute document jobs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in sorted(labels):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Thread-safe store of labelled histograms, counters and gauges"""
+
+    def __init__(self, prefix='legal_guardian'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+
+    def _name(self, name):
+        return f'{self.prefix}_{name}'
+
+    def describe(self, name, text):
+        self._help[self._name(name)] = text
+
+    def observe(self, name, value, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        key = (self._name(name), tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            families = {}
+            for (name, labels), histogram in self._histograms.items():
+                families.setdefault((name, 'histogram'), []).append((labels, histogram))
+            for (name, labels), value in self._counters.items():
+                families.setdefault((name, 'counter'), []).append((labels, value))
+            for (name, labels), value in self._gauges.items():
+                families.setdefault((name, 'gauge'), []).append((labels, value))
+
+            for (name, kind), series in sorted(families.items()):
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(series, key=lambda item: item[0]):
+                    if kind != 'histogram':
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets, value.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {value.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {value.total}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('stage_duration_seconds', 'Time spent in each document pipeline stage')
+metrics.describe('http_request_duration_seconds', 'HTTP request latency by endpoint')
+
+
+@contextmanager
+def span(stage, **labels):
+    """Time the enclosed block as one observation of the given pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('stage_duration_seconds', time.perf_counter() - started, stage=stage, **labels)
+
+
+def timed_iter(iterable, stage, **labels):
+    """Yield from iterable, recording only the time spent producing items"""
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - started
+                break
+            elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        metrics.observe('stage_duration_seconds', elapsed, stage=stage, **labels)
@@ -0,0 +1,247 @@
+"""Token-bucket rate limiting and admission control for LLM calls.
+
+Every call to the chat backend takes one token from a bucket refilled at a
+fixed rate. With ``db_path`` set, the bucket lives in a SQLite file, so every
+worker process on the host draws from the same quota. Calls that find the
+bucket empty wait in a priority queue: interactive requests (consultations,
+templates) are served ahead of bulk work (chunk analysis, merges). New requests
+are turned away with ``RateLimitExceeded`` when too many calls are already
+waiting ahead of them.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.llm_client import LLMBackend
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lower value is served first
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is refused because the LLM wait queue is full"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Bucket of ``burst`` tokens refilled at ``rate`` tokens per second"""
+
+    def __init__(self, rate, burst, db_path=None, name='llm'):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.time()
+        self._db = None
+
+        if db_path:
+            # Autocommit mode so BEGIN IMMEDIATE can lock the row across processes
+            self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+
+    def _refill_and_take(self, tokens, updated, now):
+        """Returns (remaining tokens, seconds to wait; 0 if a token was taken)"""
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def take(self):
+        """Take one token if available. Returns 0, or the seconds until one is."""
+        now = time.time()
+        with self._lock:
+            if self._db is None:
+                self._tokens, wait = self._refill_and_take(self._tokens, self._updated, now)
+                self._updated = now
+                return wait
+
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT tokens, updated FROM buckets WHERE name = ?', (self.name,)
+                ).fetchone()
+                tokens, updated = row if row is not None else (float(self.burst), now)
+                tokens, wait = self._refill_and_take(tokens, updated, now)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                    (self.name, tokens, now)
+                )
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            return wait
+
+
+class RateLimiter:
+    """Priority queue of callers waiting for tokens from a TokenBucket"""
+
+    def __init__(self, bucket, max_waiting=64):
+        self.bucket = bucket
+        self.max_waiting = max_waiting
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._async_waiters = {}  # heap entry -> (event loop, asyncio.Event) of acquire_async callers
+        # Callers blocked upstream of the limiter (e.g. on a concurrency semaphore), per level
+        self._queued = {level: 0 for level in PRIORITIES.values()}
+        self._sequence = itertools.count()
+        self.stats = {'admitted': 0, 'rejected': 0, 'acquired': 0, 'delayed': 0}
+
+    def _ahead_of(self, level):
+        waiting = sum(1 for waiter_level, _ in self._waiting if waiter_level <= level)
+        return waiting + sum(count for queued_level, count in self._queued.items() if queued_level <= level)
+
+    @contextmanager
+    def queued(self, priority='bulk'):
+        """Count the caller as waiting while it is blocked before reaching the limiter.
+
+        Without this, calls parked on a concurrency semaphore never show up in
+        admission, and admit() keeps accepting work that piles up behind it.
+        """
+        level = PRIORITIES[priority]
+        with self._cond:
+            self._queued[level] += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._queued[level] -= 1
+
+    def admit(self, priority='interactive'):
+        """Accept a new request, or raise RateLimitExceeded if the queue ahead of it is full.
+
+        Only waiters of the same or higher priority count, so interactive requests
+        are still admitted while a large upload has filled the queue with bulk calls.
+        """
+        level = PRIORITIES[priority]
+        with self._cond:
+            ahead = self._ahead_of(level)
+            if ahead >= self.max_waiting:
+                self.stats['rejected'] += 1
+                metrics.inc('llm_rate_limit_rejected_total', priority=priority)
+                retry_after = max(1, math.ceil((ahead + 1) / self.bucket.rate))
+                logger.warning(f"Rejecting {priority} request: {ahead} LLM calls already waiting")
+                raise RateLimitExceeded(f"{ahead} LLM calls already waiting", retry_after)
+            self.stats['admitted'] += 1
+
+    def acquire(self, priority='interactive'):
+        """Block until a token is available; higher-priority callers go first"""
+        entry = (PRIORITIES[priority], next(self._sequence))
+        started = time.perf_counter()
+        delayed = False
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+        try:
+            while True:
+                with self._cond:
+                    while self._waiting[0] != entry:
+                        # Woken when the caller at the head of the queue leaves
+                        self._cond.wait()
+                        delayed = True
+                # Outside the lock: a shared bucket may wait on the SQLite file lock
+                wait = self.bucket.take()
+                if wait == 0:
+                    break
+                delayed = True
+                with self._cond:
+                    self._cond.wait(wait)
+        finally:
+            with self._cond:
+                self._leave(entry)
+        with self._cond:
+            self.stats['acquired'] += 1
+            if delayed:
+                self.stats['delayed'] += 1
+        metrics.observe('llm_rate_limit_wait_seconds', time.perf_counter() - started, priority=priority)
+
+    def _leave(self, entry):
+        """Drop entry from the queue and wake whoever is at its head now. Call with _cond held."""
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+        self._cond.notify_all()
+        if self._waiting and self._waiting[0] in self._async_waiters:
+            loop, event = self._async_waiters[self._waiting[0]]
+            loop.call_soon_threadsafe(event.set)
+
+    async def acquire_async(self, priority='interactive'):
+        """acquire() for asyncio callers.
+
+        Waits on the event loop rather than in a thread, so waiting calls hold no
+        executor thread and still go through the shared priority queue.
+        """
+        entry = (PRIORITIES[priority], next(self._sequence))
+        event = asyncio.Event()
+        started = time.perf_counter()
+        delayed = False
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            self._async_waiters[entry] = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                with self._cond:
+                    at_head = self._waiting[0] == entry
+                    event.clear()
+                if at_head:
+                    # In a thread: a shared bucket may wait on the SQLite file lock
+                    wait = await asyncio.to_thread(self.bucket.take)
+                    if wait == 0:
+                        break
+                    delayed = True
+                    await asyncio.sleep(wait)
+                else:
+                    delayed = True
+                    # Woken when this caller reaches the head of the queue
+                    await event.wait()
+        finally:
+            with self._cond:
+                del self._async_waiters[entry]
+                self._leave(entry)
+        with self._cond:
+            self.stats['acquired'] += 1
+            if delayed:
+                self.stats['delayed'] += 1
+        metrics.observe('llm_rate_limit_wait_seconds', time.perf_counter() - started, priority=priority)
+
+    def get_stats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            for priority, level in PRIORITIES.items():
+                stats[f'waiting_{priority}'] = sum(1 for waiter_level, _ in self._waiting
+                                                   if waiter_level == level)
+                stats[f'queued_{priority}'] = self._queued[level]
+        return stats
+
+
+class RateLimitedBackend(LLMBackend):
+    """Backend wrapper that takes a token from the limiter before every call"""
+
+    def __init__(self, backend, limiter):
+        self.backend = backend
+        self.limiter = limiter
+        self.model = backend.model
+
+    def chat(self, prompt, max_tokens=1024, temperature=0.1, timeout=None, priority='interactive'):
+        self.limiter.acquire(priority)
+        return self.backend.chat(prompt, max_tokens=max_tokens, temperature=temperature, timeout=timeout)
+
+    def chat_stream(self, prompt, max_tokens=1024, temperature=0.1, timeout=None, priority='interactive'):
+        self.limiter.acquire(priority)
+        yield from self.backend.chat_stream(prompt, max_tokens=max_tokens,
+                                            temperature=temperature, timeout=timeout)
@@ -0,0 +1,184 @@
+"""Similarity cache for free-text questions.
+
+Questions are embedded locally as sparse hashed vectors (stemmed words, word
+bigrams and character n-grams, L2-normalized), so near-identical phrasings
+such as "how do I terminate my lease early" and "terminating a lease early"
+land close together without calling an embedding API. An inverted index over
+the hashed features gives the nearest cached question without scanning every
+entry. A similar vector is not enough for a hit: the two questions must also
+share a word bigram, so the same words in another order ("can I sue my
+landlord" / "can my landlord sue me") are told apart. Entries are grouped by
+a namespace (the prompt template fingerprint): changing the template drops the
+old answers.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+
+EMBEDDING_DIMENSIONS = 1 << 18
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset("""
+a an and are as at be by can could do does for from how i if in is it me my of on or
+our should that the this to was what when where which who will with would you your
+de del el en es la las lo los mi para por que se un una y
+""".split())
+
+_SUFFIXES = ('ations', 'ation', 'ments', 'ment', 'ings', 'ing', 'ies', 'ed', 'es', 's', 'e')
+
+
+def _stem(word):
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _feature(name):
+    digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % EMBEDDING_DIMENSIONS
+
+
+def _words(text):
+    return [_stem(w) for w in _WORD.findall(text.lower()) if w not in STOPWORDS]
+
+
+def bigrams(text):
+    """Consecutive pairs of stemmed content words of text"""
+    words = _words(text)
+    return frozenset(zip(words, words[1:]))
+
+
+def same_order(first, second):
+    """Whether two bigram sets can come from the same question.
+
+    The embedding barely weighs word order, so role-reversed questions score
+    as near duplicates. Questions of two or more content words must share at
+    least one bigram.
+    """
+    return not first or not second or not first.isdisjoint(second)
+
+
+def embed(text):
+    """Sparse unit vector {feature: weight} for text"""
+    words = _words(text)
+    counts = {}
+
+    def add(name, weight):
+        feature = _feature(name)
+        counts[feature] = counts.get(feature, 0.0) + weight
+
+    for word in words:
+        add('w:' + word, 1.0)
+        padded = f' {word} '
+        for i in range(len(padded) - 3):
+            add('c:' + padded[i:i + 4], 0.25)
+    for first, second in zip(words, words[1:]):
+        add(f'b:{first} {second}', 0.5)
+
+    norm = math.sqrt(sum(v * v for v in counts.values()))
+    if not norm:
+        return {}
+    return {feature: value / norm for feature, value in counts.items()}
+
+
+class SemanticCache:
+    """LRU cache of answers looked up by cosine similarity of the question"""
+
+    def __init__(self, threshold=0.9, max_entries=2048, ttl=86400):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (namespace, vector, value, created, bigrams)
+        self._postings = {}  # (namespace, feature) -> set of ids
+        self._next_id = 0
+        self._namespace = None
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _remove(self, entry_id):
+        namespace, vector = self._entries.pop(entry_id)[:2]
+        for feature in vector:
+            ids = self._postings.get((namespace, feature))
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._postings[(namespace, feature)]
+
+    def _nearest(self, namespace, vector, pairs):
+        """Best (similarity, id) among entries sharing a feature and the word order of pairs"""
+        scores = {}
+        for feature, weight in vector.items():
+            for entry_id in self._postings.get((namespace, feature), ()):
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * self._entries[entry_id][1][feature]
+        for entry_id in sorted(scores, key=scores.get, reverse=True):
+            if same_order(pairs, self._entries[entry_id][4]):
+                return scores[entry_id], entry_id
+        return 0.0, None
+
+    def get(self, text, namespace=''):
+        """Return the cached answer for the most similar question, or None"""
+        vector = embed(text)
+        pairs = bigrams(text)
+        with self._lock:
+            similarity, entry_id = self._nearest(namespace, vector, pairs)
+            if entry_id is not None and similarity >= self.threshold:
+                _, _, value, created, _ = self._entries[entry_id]
+                if not self._expired(created):
+                    self._entries.move_to_end(entry_id)
+                    self.stats['hits'] += 1
+                    return value
+                self._remove(entry_id)
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, text, value, namespace=''):
+        vector = embed(text)
+        if not vector:
+            return
+        pairs = bigrams(text)
+        with self._lock:
+            if namespace != self._namespace:
+                # A new namespace means the prompt changed: answers made with the old one are stale
+                stale = [entry_id for entry_id, entry in self._entries.items() if entry[0] != namespace]
+                for entry_id in stale:
+                    self._remove(entry_id)
+                self.stats['invalidations'] += len(stale)
+                self._namespace = namespace
+
+            similarity, entry_id = self._nearest(namespace, vector, pairs)
+            if entry_id is not None and similarity >= 0.999:
+                self._remove(entry_id)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (namespace, vector, value, time.time(), pairs)
+            for feature in vector:
+                self._postings.setdefault((namespace, feature), set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, namespace=None):
+        """Drop the entries of one namespace, or all of them"""
+        with self._lock:
+            doomed = [entry_id for entry_id, entry in self._entries.items()
+                      if namespace is None or entry[0] == namespace]
+            for entry_id in doomed:
+                self._remove(entry_id)
+            self.stats['invalidations'] += len(doomed)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,142 @@
+"""Server-side conversation sessions.
+
+A session holds the recent turns of a conversation, a running summary of the
+older ones and the analyses of documents shared in it. Without a database,
+sessions live in an in-memory LRU with an idle TTL. With ``db_path`` set they
+live in SQLite instead, so they survive restarts and every worker process sees
+the same conversations: reads go to the database, and changes are applied with
+``update()`` to the latest stored record inside a write transaction, so one
+worker never overwrites turns another worker has just added.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+def new_session():
+    return {
+        'id': uuid.uuid4().hex,
+        'summary': '',
+        'turns': [],
+        'documents': [],
+        'updated': time.time()
+    }
+
+
+class SessionStore:
+    """Sessions that expire after ttl seconds without activity"""
+
+    def __init__(self, max_sessions=1000, ttl=24 * 3600, db_path=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {'created': 0, 'expired': 0, 'evictions': 0}
+
+        if db_path:
+            # Autocommit mode so BEGIN IMMEDIATE can lock the record across processes
+            self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'id TEXT PRIMARY KEY, record TEXT NOT NULL, updated REAL NOT NULL)'
+            )
+
+    def _expired(self, session):
+        return self.ttl is not None and time.time() - session['updated'] > self.ttl
+
+    def _remember(self, session):
+        self._sessions[session['id']] = session
+        self._sessions.move_to_end(session['id'])
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _load(self, session_id):
+        row = self._db.execute('SELECT record FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _write(self, session):
+        self._db.execute(
+            'INSERT OR REPLACE INTO sessions (id, record, updated) VALUES (?, ?, ?)',
+            (session['id'], json.dumps(session), session['updated'])
+        )
+
+    def get(self, session_id):
+        """The live session with this ID, or None if it is unknown or expired"""
+        if not session_id:
+            return None
+        with self._lock:
+            if self._db is not None:
+                session = self._load(session_id)
+            else:
+                session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._expired(session):
+                self._sessions.pop(session_id, None)
+                if self._db is not None:
+                    self._db.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+                self.stats['expired'] += 1
+                return None
+            if self._db is None:
+                self._remember(session)
+            return session
+
+    def get_or_create(self, session_id=None):
+        session = self.get(session_id)
+        if session is None:
+            session = new_session()
+            with self._lock:
+                if self._db is not None:
+                    self._write(session)
+                    # Expired conversations nobody came back to
+                    if self.ttl is not None:
+                        self._db.execute('DELETE FROM sessions WHERE updated <= ?', (time.time() - self.ttl,))
+                else:
+                    self._remember(session)
+                self.stats['created'] += 1
+        return session
+
+    def update(self, session, change):
+        """Apply change(record) to the latest version of session and store it.
+
+        With a database, the record is re-read inside a write transaction, so
+        changes made by other workers since session was loaded are kept. The
+        stored result is copied back into session.
+        """
+        with self._lock:
+            if self._db is None:
+                change(session)
+                session['updated'] = time.time()
+                self._remember(session)
+                return session
+
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                record = self._load(session['id']) or dict(session)
+                change(record)
+                record['updated'] = time.time()
+                self._write(record)
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        session.clear()
+        session.update(record)
+        return session
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            if self._db is not None:
+                stats['active'] = self._db.execute(
+                    'SELECT COUNT(*) FROM sessions WHERE updated > ?', (time.time() - self.ttl,)
+                ).fetchone()[0]
+            else:
+                stats['active'] = len(self._sessions)
+        return stats
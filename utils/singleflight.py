@@ -0,0 +1,218 @@
+"""Single-flight deduplication of identical in-flight LLM calls.
+
+While a call for a given key (the prompt fingerprint) is running, identical
+calls wait for it and share its result, or its exception, instead of sending
+their own request. This holds across threads and asyncio tasks in a process.
+
+With ``db_path`` set, processes on the host also coordinate through a SQLite
+file. The first process to claim a key makes the call under a lease and
+publishes the result there. The others poll for it, and make the call
+themselves if the lease runs out (e.g. the owner crashed).
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one"""
+
+    def __init__(self, db_path=None, lease=120, poll_interval=0.2, result_ttl=60):
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._tasks = {}  # (event loop, key) -> asyncio.Task
+        self._db = None
+        self.stats = {'calls': 0, 'shared': 0, 'process_shared': 0, 'lease_expired': 0, 'max_waiters': 0}
+
+        if db_path:
+            # Autocommit mode so BEGIN IMMEDIATE can lock the rows across processes
+            self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                                       isolation_level=None)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS singleflight_calls ('
+                'key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS singleflight_results ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)'
+            )
+
+    # Cross-process coordination
+
+    def _claim(self, key):
+        """('result', value) if another process published one, 'claimed' or 'busy'"""
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT value FROM singleflight_results WHERE key = ? AND created > ?',
+                    (key, now - self.result_ttl)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute('COMMIT')
+                    return 'result', json.loads(row[0])
+
+                row = self._db.execute(
+                    'SELECT owner, expires FROM singleflight_calls WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None and row[0] != self._owner and row[1] > now:
+                    self._db.execute('COMMIT')
+                    return 'busy', None
+                if row is not None and row[0] != self._owner:
+                    self.stats['lease_expired'] += 1
+                self._db.execute(
+                    'INSERT OR REPLACE INTO singleflight_calls (key, owner, expires) VALUES (?, ?, ?)',
+                    (key, self._owner, now + self.lease)
+                )
+                self._db.execute('COMMIT')
+                return 'claimed', None
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _finish(self, key, value=None, publish=False):
+        """Release a claimed key, publishing its result for waiting processes"""
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('DELETE FROM singleflight_calls WHERE key = ? AND owner = ?',
+                                 (key, self._owner))
+                if publish:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO singleflight_results (key, value, created) VALUES (?, ?, ?)',
+                        (key, json.dumps(value), now)
+                    )
+                self._db.execute('DELETE FROM singleflight_results WHERE created <= ?',
+                                 (now - self.result_ttl,))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _run_shared(self, key, fn):
+        """Run fn unless another process is already running it for key"""
+        if self._db is None:
+            return fn()
+        deadline = time.time() + self.lease
+        while True:
+            state, value = self._claim(key)
+            if state == 'result':
+                with self._lock:
+                    self.stats['process_shared'] += 1
+                return value
+            if state == 'claimed':
+                break
+            if time.time() > deadline:
+                # Waited a whole lease without a result: make the call ourselves
+                return fn()
+            time.sleep(self.poll_interval)
+
+        try:
+            value = fn()
+        except Exception:
+            self._finish(key)
+            raise
+        self._finish(key, value, publish=True)
+        return value
+
+    async def _run_shared_async(self, key, fn):
+        if self._db is None:
+            return await fn()
+        deadline = time.time() + self.lease
+        while True:
+            state, value = await asyncio.to_thread(self._claim, key)
+            if state == 'result':
+                with self._lock:
+                    self.stats['process_shared'] += 1
+                return value
+            if state == 'claimed':
+                break
+            if time.time() > deadline:
+                return await fn()
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            value = await fn()
+        except Exception:
+            await asyncio.to_thread(self._finish, key)
+            raise
+        await asyncio.to_thread(self._finish, key, value, True)
+        return value
+
+    # Public API
+
+    def do(self, key, fn):
+        """Return fn(), sharing a single call among concurrent callers with the same key"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats['calls'] += 1
+            else:
+                flight.waiters += 1
+                self.stats['shared'] += 1
+                self.stats['max_waiters'] = max(self.stats['max_waiters'], flight.waiters)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._run_shared(key, fn)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, key, fn):
+        """Await fn(), sharing a single call among concurrent tasks with the same key"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get((loop, key))
+            if task is None:
+                task = loop.create_task(self._run_shared_async(key, fn))
+                self._tasks[(loop, key)] = task
+                self.stats['calls'] += 1
+
+                def forget(_):
+                    with self._lock:
+                        self._tasks.pop((loop, key), None)
+                task.add_done_callback(forget)
+            else:
+                self.stats['shared'] += 1
+        # shield: a cancelled waiter must not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._flights) + len(self._tasks)
+        return stats
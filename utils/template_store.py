@@ -0,0 +1,253 @@
+"""Store for generated legal templates.
+
+Template prompts run at a low temperature, so the output for a given document
+type barely changes between calls. Requests are folded onto a canonical
+document type (case, whitespace, punctuation and common synonyms), served from
+memory, and refreshed in the background once they are older than the TTL.
+The memory tier is an LRU capped at ``max_entries``. With ``db_path`` set,
+templates are also kept in a SQLite file keyed by the normalized type, so
+every worker process (and the ``prewarm-templates`` command) shares them. The periodic refresher only
+regenerates the common types and entries that were requested since they were
+last generated; other stale entries (one-off requests, typos) are dropped.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Standard template types that make up most legal-templates traffic
+COMMON_TEMPLATE_TYPES = [
+    'Non-disclosure Agreement',
+    'Employment Contract',
+    'Will',
+    'Power of Attorney',
+]
+
+# Normalized spelling -> canonical document type
+TEMPLATE_SYNONYMS = {
+    'nda': 'Non-disclosure Agreement',
+    'non disclosure agreement': 'Non-disclosure Agreement',
+    'nondisclosure agreement': 'Non-disclosure Agreement',
+    'confidentiality agreement': 'Non-disclosure Agreement',
+    'mutual nda': 'Non-disclosure Agreement',
+    'employment contract': 'Employment Contract',
+    'employment agreement': 'Employment Contract',
+    'contract of employment': 'Employment Contract',
+    'will': 'Will',
+    'last will': 'Will',
+    'last will and testament': 'Will',
+    'testament': 'Will',
+    'power of attorney': 'Power of Attorney',
+    'poa': 'Power of Attorney',
+    'durable power of attorney': 'Power of Attorney',
+}
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+_TRAILING_NOISE = re.compile(r'(\s+(template|form|document|doc))+$')
+
+
+def normalize_document_type(document_type):
+    """Fold a requested document type onto its canonical name.
+
+    Returns (key, canonical_name). Unknown types keep the user's wording as
+    canonical name, keyed by their folded spelling.
+    """
+    folded = _NON_WORD.sub(' ', (document_type or '').lower()).strip()
+    folded = _TRAILING_NOISE.sub('', folded)
+    folded = re.sub(r'^(an?|the)\s+', '', folded)
+    canonical = TEMPLATE_SYNONYMS.get(folded)
+    if canonical:
+        return canonical.lower(), canonical
+    return folded, (document_type or '').strip()
+
+
+class TemplateStore:
+    """Serve templates from memory (and SQLite) with stale-while-revalidate refresh"""
+
+    def __init__(self, generate, ttl=24 * 3600, max_workers=4, max_entries=256,
+                 pinned=COMMON_TEMPLATE_TYPES, db_path=None):
+        self._generate = generate
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Keys the background refresher keeps fresh even when nobody asked for them lately
+        self.pinned = {normalize_document_type(document_type)[0] for document_type in pinned}
+        self._entries = OrderedDict()  # key -> (content, created, hits since created)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='template-refresh')
+        self._refresher = None
+        self._db = None
+        self.stats = {'hits': 0, 'stale_hits': 0, 'disk_hits': 0, 'misses': 0,
+                      'refreshes': 0, 'evictions': 0}
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS templates ('
+                'key TEXT PRIMARY KEY, content TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            self._db.commit()
+
+    def _remember(self, key, content, created, hits=0):
+        """Add an entry to the memory tier. Call with _lock held."""
+        self._entries[key] = (content, created, hits)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _load(self, key):
+        """(content, created) stored by any process, or None. Call with _lock held."""
+        if self._db is None:
+            return None
+        return self._db.execute('SELECT content, created FROM templates WHERE key = ?', (key,)).fetchone()
+
+    def _store(self, key, content):
+        created = time.time()
+        with self._lock:
+            self._remember(key, content, created)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO templates (key, content, created) VALUES (?, ?, ?)',
+                    (key, content, created)
+                )
+                self._db.commit()
+
+    def _refresh(self, key, canonical):
+        try:
+            with self._lock:
+                row = self._load(key)
+                if row is not None and time.time() - row[1] <= self.ttl:
+                    # Another process refreshed it already
+                    self._remember(key, *row)
+                    return
+            self._store(key, self._generate(canonical))
+            with self._lock:
+                self.stats['refreshes'] += 1
+        except Exception as e:
+            logger.warning(f"Background refresh of '{canonical}' template failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _schedule_refresh(self, key, canonical):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key, canonical)
+
+    def get(self, document_type):
+        """Return the template text for document_type, generating it on a miss"""
+        content = self.lookup(document_type)
+        if content is not None:
+            return content
+
+        key, canonical = normalize_document_type(document_type)
+        content = self._generate(canonical)
+        self._store(key, content)
+        return content
+
+    def lookup(self, document_type):
+        """Return the stored template for document_type without generating it.
+
+        A None result counts as a miss: the caller is expected to generate the
+        template and put() it.
+        """
+        key, canonical = normalize_document_type(document_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                row = self._load(key)
+                if row is None:
+                    self.stats['misses'] += 1
+                    return None
+                # Generated by another process (or prewarm-templates)
+                self.stats['disk_hits'] += 1
+                entry = (*row, 0)
+            content, created, hits = entry
+            self._remember(key, content, created, hits + 1)
+        if time.time() - created > self.ttl:
+            with self._lock:
+                self.stats['stale_hits'] += 1
+            self._schedule_refresh(key, canonical)
+        else:
+            with self._lock:
+                self.stats['hits'] += 1
+        return content
+
+    def put(self, document_type, content):
+        """Store a template generated outside the store (e.g. streamed)"""
+        key, _ = normalize_document_type(document_type)
+        self._store(key, content)
+
+    def prewarm(self, document_types=COMMON_TEMPLATE_TYPES):
+        """Generate templates for document_types in parallel. Returns the warmed names.
+
+        Types with a fresh template in the database are loaded instead of
+        generated again, so workers starting together share one prewarm.
+        """
+        def warm(document_type):
+            key, canonical = normalize_document_type(document_type)
+            with self._lock:
+                row = self._load(key)
+                if row is not None and time.time() - row[1] <= self.ttl:
+                    self._remember(key, *row)
+                    return canonical
+            try:
+                self._store(key, self._generate(canonical))
+                return canonical
+            except Exception as e:
+                logger.warning(f"Pre-warming '{canonical}' template failed: {str(e)}")
+                return None
+
+        warmed = list(self._executor.map(warm, document_types))
+        return [name for name in warmed if name]
+
+    def start_background_refresh(self, interval=None):
+        """Periodically refresh stale entries that are pinned or were used since their last refresh.
+
+        Stale entries nobody asked for are evicted instead, so LLM spend does not
+        grow with the number of distinct document types ever requested.
+        """
+        if self._refresher is not None:
+            return
+        interval = interval or max(60, self.ttl / 4)
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                now = time.time()
+                stale = []
+                with self._lock:
+                    for key, (_, created, hits) in list(self._entries.items()):
+                        if now - created <= self.ttl:
+                            continue
+                        if key in self.pinned or hits:
+                            stale.append(key)
+                        else:
+                            del self._entries[key]
+                            if self._db is not None:
+                                self._db.execute('DELETE FROM templates WHERE key = ? AND created = ?',
+                                                 (key, created))
+                            self.stats['evictions'] += 1
+                    if self._db is not None:
+                        self._db.commit()
+                for key in stale:
+                    _, canonical = normalize_document_type(key)
+                    self._schedule_refresh(key, canonical)
+
+        self._refresher = threading.Thread(target=loop, name='template-refresher', daemon=True)
+        self._refresher.start()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        return stats
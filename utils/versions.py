@@ -0,0 +1,78 @@
+"""Chunks and chunk analyses of the latest version of each tracked document.
+
+When a revised version of a document is uploaded under the same document ID,
+its text is re-chunked around the previous version's chunks and only the
+chunks that changed are sent to the LLM. Records live in an in-memory LRU
+and, optionally, in a SQLite file that survives restarts.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class DocumentVersionStore:
+    """LRU map of document ID -> {'version', 'updated', 'chunks': [{'text', 'key', 'analysis'}]}"""
+
+    def __init__(self, max_documents=256, db_path=None):
+        self.max_documents = max_documents
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS document_versions ('
+                'document_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated REAL NOT NULL)'
+            )
+            self._db.commit()
+
+    def _remember(self, document_id, record):
+        self._documents[document_id] = record
+        self._documents.move_to_end(document_id)
+        while len(self._documents) > self.max_documents:
+            self._documents.popitem(last=False)
+
+    def get(self, document_id):
+        """Latest recorded version of document_id, or None"""
+        with self._lock:
+            record = self._documents.get(document_id)
+            if record is not None:
+                self._documents.move_to_end(document_id)
+                return record
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT record FROM document_versions WHERE document_id = ?', (document_id,)
+                ).fetchone()
+                if row is not None:
+                    record = json.loads(row[0])
+                    self._remember(document_id, record)
+                    return record
+            return None
+
+    def put(self, document_id, chunks):
+        """Record chunks as the next version of document_id. Returns the version number."""
+        with self._lock:
+            previous = self._documents.get(document_id)
+            if previous is None and self._db is not None:
+                row = self._db.execute(
+                    'SELECT record FROM document_versions WHERE document_id = ?', (document_id,)
+                ).fetchone()
+                previous = json.loads(row[0]) if row is not None else None
+
+            record = {
+                'version': previous['version'] + 1 if previous else 1,
+                'updated': time.time(),
+                'chunks': chunks
+            }
+            self._remember(document_id, record)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO document_versions (document_id, record, updated) VALUES (?, ?, ?)',
+                    (document_id, json.dumps(record), record['updated'])
+                )
+                self._db.commit()
+            return record['version']